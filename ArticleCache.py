@@ -0,0 +1,123 @@
+# Class to keep the parsed sections of Wikipedia articles on disk
+import hashlib
+import os
+import pickle
+import zlib
+
+class ArticleCache:
+    """
+    Content addressed cache on disk for the result of parsing an article (see Sections). The key is the name
+    of the dump, the page id and the revision id, the file is named after the hash of the key. When the size
+    of the cache is above max_bytes, the least recently used files are removed; the modification time of a
+    file is updated when it is read.
+    """
+
+    evict_fraction = 0.9  # After removing files the cache has this fraction of max_bytes
+
+
+    def __init__(self, cache_dir, max_bytes, dump):
+        """
+        :param cache_dir: directory of the cache, shared by all dumps
+        :param max_bytes: maximum size of the files in the cache
+        :param dump: name of the dump file, part of the key
+        """
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.dump = os.path.basename( dump)
+        self.bytes = None  # Size of the cache, determined at the first put
+
+
+    def __filename(self, page_id, revision_id):
+        """
+        Returns the name of the file of the article
+        :param page_id:
+        :param revision_id:
+        :return:
+        """
+
+        key = hashlib.sha1( f"{self.dump}|{page_id}|{revision_id}".encode("utf-8")).hexdigest()
+        return os.path.join( self.cache_dir, key[:2], key + ".bin")
+
+
+    def get(self, page_id, revision_id):
+        """
+        Returns the cached value of the article
+        :param page_id:
+        :param revision_id:
+        :return: the value or None if it is not in the cache
+        """
+
+        filename = self.__filename( page_id, revision_id)
+        try:
+            with open( filename, "rb") as file:
+                value = pickle.loads( zlib.decompress( file.read()))
+            os.utime( filename)  # Recently used
+        except (OSError, EOFError, zlib.error, pickle.UnpicklingError):  # Not in the cache, removed or damaged
+            return None
+
+        return value
+
+
+    def put(self, page_id, revision_id, value):
+        """
+        Add the value of the article to the cache
+        :param page_id:
+        :param revision_id:
+        :param value: object that can be pickled
+        :return:
+        """
+
+        filename = self.__filename( page_id, revision_id)
+        data = zlib.compress( pickle.dumps( value, protocol=pickle.HIGHEST_PROTOCOL))
+        os.makedirs( os.path.dirname( filename), exist_ok=True)
+
+        temporary = f"{filename}.{os.getpid()}.tmp"  # Other processes can write the same article
+        with open( temporary, "wb") as file:
+            file.write( data)
+        os.replace( temporary, filename)
+
+        if self.bytes is None:
+            self.bytes = sum( size for (_, size, _) in self.__files())
+        else:
+            self.bytes += len(data)
+        if self.bytes > self.max_bytes:
+            self.__evict()
+
+
+    def __files(self):
+        """
+        Returns all files in the cache
+        :return: list of (filename, size, modification time)
+        """
+
+        files = []
+        for directory in os.scandir( self.cache_dir):
+            if directory.is_dir():
+                for entry in os.scandir( directory.path):
+                    if entry.name.endswith(".bin"):
+                        try:
+                            stat = entry.stat()
+                        except OSError:  # Removed by another process
+                            continue
+                        files.append( (entry.path, stat.st_size, stat.st_mtime))
+
+        return files
+
+
+    def __evict(self):
+        """
+        Remove the least recently used files until the size is below evict_fraction of the maximum
+        :return:
+        """
+
+        files = sorted( self.__files(), key=lambda file: file[2])
+        self.bytes = sum( size for (_, size, _) in files)
+        for (filename, size, _) in files:
+            if self.bytes <= ArticleCache.evict_fraction * self.max_bytes:
+                break
+            try:
+                os.remove( filename)
+            except OSError:  # Removed by another process
+                pass
+            self.bytes -= size
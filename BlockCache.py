@@ -0,0 +1,79 @@
+# Class to keep decompressed blocks of the Wikipedia dump in memory
+from collections import OrderedDict
+
+class BlockCache:
+    """
+    Least recently used cache for decompressed multistream blocks, keyed by the offset of the block in the dump.
+    The size of the cache is limited by the total number of bytes of the cached blocks.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        Create the cache
+        :param max_bytes: maximum number of bytes of all cached blocks together, 0 disables the cache
+        """
+
+        self.max_bytes = max_bytes
+        self.blocks = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key):
+        """
+        Returns the cached block and marks it as recently used
+        :param key: offset of the block
+        :return: the block or None if it is not in the cache
+        """
+
+        if key in self.blocks:
+            self.blocks.move_to_end( key)
+            self.hits += 1
+            return self.blocks[key][0]
+
+        self.misses += 1
+        return None
+
+
+    def put(self, key, block, size):
+        """
+        Add a block to the cache, the least recently used blocks are removed if the cache becomes too large
+        :param key: offset of the block
+        :param block: the decompressed block
+        :param size: size of the block in bytes
+        :return:
+        """
+
+        if size > self.max_bytes:  # Would remove everything else
+            return
+
+        if key in self.blocks:
+            self.bytes -= self.blocks.pop( key)[1]
+
+        self.blocks[key] = (block, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            (_, (_, removed)) = self.blocks.popitem( last=False)
+            self.bytes -= removed
+
+
+    def clear(self):
+        """
+        Remove all blocks from the cache, the counters are kept
+        :return:
+        """
+
+        self.blocks.clear()
+        self.bytes = 0
+
+
+    def statistics(self):
+        """
+        Returns a line with the statistics of the cache
+        :return:
+        """
+
+        total = self.hits + self.misses
+        ratio = (self.hits / total) if total > 0 else 0
+        return f"Block cache: {self.hits} hits, {self.misses} misses ({ratio:.1%} hits), {len(self.blocks)} blocks, {self.bytes} bytes"
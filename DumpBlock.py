@@ -0,0 +1,88 @@
+# Class to find pages in a decompressed block of the Wikipedia dump
+
+class DumpBlock:
+    """
+    A decompressed multistream block of about 100 pages. Pages are located with a byte scan that stops as soon
+    as the requested page is found, the positions of the pages that were passed are remembered for later lookups.
+    """
+
+    def __init__(self, data):
+        """
+        :param data: the decompressed block
+        """
+
+        self.data = data
+        self.pages = {}     # articleid -> (start, end)
+        self.position = 0   # Position where the scan continues
+
+
+    def __len__(self):
+        return len(self.data)
+
+
+    def find_page(self, articleid):
+        """
+        Find the position of the page with the given id
+        :param articleid:
+        :return: (start, end) of the page in data or None if the block does not contain the page
+        """
+
+        if articleid in self.pages:
+            return self.pages[articleid]
+
+        for (found, (start, end)) in self.__scan():
+            if found == articleid:
+                return (start, end)
+
+        self.position = len(self.data)
+        return None
+
+
+    def complete_pages(self):
+        """
+        Returns the complete pages after the position where the scan continues, in the order of the data. After
+        the last page the position is at the end of the last complete page, an incomplete page is not returned
+        :return: generator of (articleid, xml as bytes)
+        """
+
+        for (found, (start, end)) in self.__scan():
+            yield (found, self.data[start:end])
+
+
+    def __scan(self):
+        """
+        Find the complete pages from the position where the scan continues, the position is updated after every page
+        :return: generator of (articleid, (start, end))
+        """
+
+        data = self.data
+        position = data.find(b"<page>", self.position)
+        while position >= 0:
+            end = data.find(b"</page>", position)
+            if end < 0:  # Incomplete page
+                break
+
+            end += len(b"</page>")
+            id_start = data.find(b"<id>", position, end) + len(b"<id>")  # The first id is the id of the page
+            id_end = data.find(b"</id>", id_start, end)
+            found = int( data[id_start:id_end])
+            if not found in self.pages:
+                self.pages[found] = (position, end)
+
+            self.position = end
+            yield (found, (position, end))
+            position = data.find(b"<page>", end)
+
+
+    def page(self, articleid):
+        """
+        Returns the xml of the page with the given id
+        :param articleid:
+        :return: the xml as bytes or None if the block does not contain the page
+        """
+
+        location = self.find_page( articleid)
+        if location is None:
+            return None
+
+        return self.data[location[0]:location[1]]
@@ -113,22 +113,24 @@ class GWikiMatch:
         articles.sort()
         wikidata = WDSparql( "cache", self.wikidata_endpoint, self.debug)
 
-        for chunk in functions.create_chunks_of_list( articles, 50):
-            for row in self.__translate_to_ids(chunk, wikidata):
-                translation[row[0]] = row[1]
+        rows = wikidata.query_chunks( functions.create_chunks_of_list( articles, 50), self.__translate_to_ids_query, "translate_")
+        for row in rows:
+            id = row["item"]["value"].replace('http://www.wikidata.org/entity/', '') # Just the ID
+            url = row["urls"]["value"].replace('https://', 'http://') # translate into http
+            translation[url] = id
 
         return translation
 
 
 
-    def __translate_to_ids(self, urls, wikidata):
+    def __translate_to_ids_query(self, urls):
         """
-        Performs a SPARQL query to translate the urls to WikiData IDs
+        Returns the SPARQL query to translate the urls to WikiData IDs
         :param urls:
-        :return: list of tuples [(url,id)]
+        :return: the query
         """
         wikidataurls = ["<" + url.replace("http://", "https://") + ">" for url in urls]
-        query = f"""
+        return f"""
         SELECT ?item ?urls WHERE {{
           VALUES ?urls {{
             {" ".join( wikidataurls)}
@@ -137,28 +139,18 @@ class GWikiMatch:
           ?urls schema:about ?item
         }}
         """
-        rows = wikidata.query( query, "translate_" + query)
-
-        translation = []
-
-        # Read items from results
-        for row in rows:
-            id = row["item"]["value"].replace('http://www.wikidata.org/entity/', '') # Just the ID
-            url = row["urls"]["value"].replace('https://', 'http://') # translate into http
-            translation.append( (url, id))
-
-        return translation
 
 
-    def __get_urls_of_ids(self, ids, language, wikidata):
+    def __get_urls_of_ids_query(self, ids, language):
         """
-        Performs a SPARQL query to translate the ids to corresponding wikipedia urls
+        Returns the SPARQL query to translate the ids to corresponding wikipedia urls
         :param  ids:
-        :return: list of tuples [(url,id)]
+        :param language:
+        :return: the query
         """
 
         wikidataids = ["wd:" + id for id in ids]
-        query = f"""
+        return f"""
         SELECT ?article ?items WHERE {{
           VALUES ?items {{
             {" ".join(wikidataids)}
@@ -168,16 +160,6 @@ class GWikiMatch:
         ?article schema:isPartOf <https://{language}.wikipedia.org/>
         }}
         """
-        rows = wikidata.query(query, "translate_" + query)
-        translation = []
-
-        # Read items from results
-        for row in rows:
-            id = row["items"]["value"].replace('http://www.wikidata.org/entity/', '') # Just the ID
-            url = row["article"]["value"]
-            translation.append( (id,url))
-
-        return translation
 
 
 
@@ -211,9 +193,11 @@ class GWikiMatch:
         wikidata = WDSparql( "cache", self.wikidata_endpoint, self.debug)
 
         with_url = []
-        for chunk in functions.create_chunks_of_list( articles, 500):
-            for row in self.__get_urls_of_ids(chunk, language, wikidata):
-                with_url.append( row)
+        rows = wikidata.query_chunks( functions.create_chunks_of_list( articles, 500), lambda ids: self.__get_urls_of_ids_query( ids, language), "translate_")
+        for row in rows:
+            id = row["items"]["value"].replace('http://www.wikidata.org/entity/', '') # Just the ID
+            url = row["article"]["value"]
+            with_url.append( (id,url))
 
         return with_url
 
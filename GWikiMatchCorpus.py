@@ -10,61 +10,78 @@ from Wikidata import Wikidata
 from Sections import Sections
 from GWikiMatch import GWikiMatch
 from Links import Links
+from ArticleCache import ArticleCache
+from WikiDataSparql import WDSparql
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import os
 
 # Constants
 wikidata_enpoint = "https://query.wikidata.org/sparql"
 wikipedia_dumpdir = "../../WikipediaDump"
+article_cache_dir = os.path.join("cache", "articles")
 
 
 def read_arguments():
     """
     Read arguments from the command line
-    :return: (outputdirectory, language)
+    :return: (inputdirectory, outputdirectory, language, workers, redirects, article_cache_size)
     """
 
     parser = argparse.ArgumentParser(description='Read articles from wikipedia based on the gWikiDataset.')
     parser.add_argument('-l', '--language', help='Language code, for example "nl" or "en"', required=True, default="en")
     parser.add_argument('-i', '--input', help='Input directory (relative to this script)', required=True)
     parser.add_argument('-o', '--output', help='Output directory', required=True)
+    parser.add_argument('-w', '--workers', help='Number of processes used for decompressing the dump and splitting the articles', required=False, type=int, default=1)
+    parser.add_argument('-r', '--redirects', help='Resolve titles that are redirects to the article they point to', action='store_true')
+    parser.add_argument('--article-cache', help='Maximum size in MB of the cache with parsed articles, 0 for no cache', required=False, type=int, default=0)
     args = vars(parser.parse_args())
 
-    return (args["input"], args["output"], args["language"].lower())
+    return (args["input"], args["output"], args["language"].lower(), args["workers"], args["redirects"], args["article_cache"])
 
 
 
-def save_article(wikidata, wikidata_id, name, links, output):
+def save_articles(articles, output, workers, cache=None, language=None):
     """
-    Save the row (id, url) in an xml file
-    :param row:
+    Save the articles in xml files with sections
+    :param articles: iterable of (wikidata_id, xml, links)
     :param output: output directory
+    :param workers: number of processes that split the articles
+    :param cache: None or the ArticleCache of the dump
+    :param language: language code of the articles
     :return:
     """
 
-    lemma = wikidata.url_to_name(name)
-    id = wikidata_id.replace("wd:", "")
-    if not lemma is None:
-        xml = wikidata.read_wikipedia_article(id, lemma)
-        if not xml is None:
-            sections = Sections( contents=xml)
-            sections.create_sections(with_keys=False, links=links, id=wikidata_id, output_dir=output)
+    chunks = functions.create_chunks_of_iterable(articles, Sections.articles_per_task)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for _ in functions.bounded_map(executor, workers * Wikidata.max_pending_per_worker, Sections.create_sections_of_articles, chunks, repeat(output), repeat(cache), repeat(language)):
+                pass
+    else:
+        for chunk in chunks:
+            Sections.create_sections_of_articles(chunk, output, cache, language)
 
 
 # Main part of the script
 if __name__ == '__main__':
-    (input, output, language) = read_arguments()
+    (input, output, language, workers, redirects, article_cache_size) = read_arguments()
 
     wikimatch = GWikiMatch(dir=input, wikidata_endpoint=wikidata_enpoint, debug=False)
     articles = wikimatch.get_all_articles_with_url( language)
 
     wikidata = Wikidata(wikidata_endpoint=wikidata_enpoint, subjects=[], dump_dir=wikipedia_dumpdir,
-                        language=language, debug=False)
+                        language=language, debug=False, workers=workers, resolve_redirects=redirects)
 
     functions.create_directory_if_not_exists(output)
-    for article in articles:
-        links = wikimatch.get_links_of_article( id=article[0])
-        save_article(wikidata, wikidata_id=article[0], name=article[1], output=output, links=links)
+    names = [(article[0], wikidata.url_to_name(article[1])) for article in articles]
+    articles = ((wikidata_id, xml, wikimatch.get_links_of_article( id=wikidata_id))
+                for (wikidata_id, lemma, xml) in wikidata.read_wikipedia_articles(names) if not xml is None)
+    cache = ArticleCache(article_cache_dir, article_cache_size * 1024 * 1024, wikidata.dump_file) if article_cache_size > 0 else None
+    save_articles(articles, output=output, workers=workers, cache=cache, language=language)
 
     functions.write_corpus_info(output, "GWikiMatch " + language.upper(), "en")
 
     functions.write_article_pairs(output, wikimatch.info)
+
+    print( wikidata.block_cache.statistics())
+    print( WDSparql.cache_statistics())
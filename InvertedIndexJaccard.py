@@ -0,0 +1,68 @@
+# Class to calculate the jaccard index between the links of documents with an inverted index
+import functions
+
+class InvertedIndexJaccard:
+    """
+    Calculates the jaccard index between all articles and between all sections. An inverted index from link
+    target to the documents that contain it is used to find the documents that share at least one link, only
+    those pairs are scored. Targets that are in more than max_document_frequency documents are not used to
+    find candidates, the intersection of the candidates is then calculated from the complete sets.
+    """
+
+    def __init__(self, links_for_id, max_document_frequency=None):
+        """
+        Create the inverted indexes
+        :param links_for_id: dictionary with the id as key and a set of links as value, ids with an "_" are sections
+        :param max_document_frequency: targets in more documents are skipped for candidates, None uses all targets
+        """
+
+        self.links_for_id = links_for_id
+        self.max_document_frequency = max_document_frequency
+        self.groups = {}
+        self.group_of_id = {}
+        for is_section in [False, True]:
+            ids = [id for id in links_for_id.keys() if ("_" in id) == is_section]  # In the order of the dictionary
+            postings = {}
+            for (row, id) in enumerate( ids):
+                self.group_of_id[id] = (is_section, row)
+                for link in links_for_id[id]:
+                    postings.setdefault( link, []).append( row)
+
+            self.groups[is_section] = {
+                "ids": ids,
+                "main": [id.split("_")[0] for id in ids],
+                "postings": postings
+            }
+
+
+    def distances(self, id):
+        """
+        Calculates the jaccard index between this and all other documents (articles with articles and sections
+        with sections), but not with the sections of the same article
+        :param id:
+        :return: generator of (id, distance) for all distances above zero, in the order of the links dictionary
+        """
+
+        (is_section, row) = self.group_of_id[id]
+        group = self.groups[is_section]
+        links = self.links_for_id[id]
+
+        # Count the shared links per candidate
+        counts = {}
+        skipped = False
+        for link in links:
+            posting = group["postings"][link]
+            if self.max_document_frequency is None or len(posting) <= self.max_document_frequency:
+                for other in posting:
+                    counts[other] = counts.get( other, 0) + 1
+            else:
+                skipped = True
+
+        main_id = group["main"][row]
+        for other in sorted( counts.keys()):
+            if group["main"][other] != main_id:  # Don't compare to yourself
+                other_links = self.links_for_id[group["ids"][other]]
+                intersection_length = len( links & other_links) if skipped else counts[other]
+                index = functions.jaccard_index( intersection_length, len(links) + len(other_links) - intersection_length)
+                if index > 0:
+                    yield (group["ids"][other], index)
@@ -2,82 +2,212 @@
 import xml.etree.ElementPath
 
 from lxml import etree as ET
+import array
 import functions
+import hashlib
+import heapq
+import math
+import multiprocessing
 import os
+import pickle
+import random
+from TextStore import TextStore
+from SparseJaccard import SparseJaccard
+from InvertedIndexJaccard import InvertedIndexJaccard
+from MinHashJaccard import MinHashJaccard
 
 class Links:
-    def __init__(self, files):
+    similarity_methods = ["sparse", "inverted", "minhash"]
+    ranges_per_worker = 16      # Number of file ranges per worker in save_distance_parallel
+    shared = None               # The Links object that is shared with the forked worker processes
+    state_filename = "links-state.pkl"  # The state of the previous run for save_distance_incremental
+    incremental_fraction = 0.5  # Above this fraction of changed ids everything is calculated again
+
+    def __init__(self, files, similarity="sparse", max_document_frequency=None, permutations=128, bands=32, spill_dir=None, state_file=None, documents=None):
         """
-        Create a sections object
+        Create a sections object, every file is parsed once
         :param files: filenames to be processed
+        :param similarity: method for the jaccard indexes, "sparse" (matrix products), "inverted" (inverted index)
+                           or "minhash" (approximation with locality sensitive hashing)
+        :param max_document_frequency: for "inverted", link targets in more documents are not used to find candidates
+        :param permutations: for "minhash", the number of hash functions
+        :param bands: for "minhash", the number of bands
+        :param spill_dir: if not None, the texts of the sections are kept in a temporary file in this directory
+        :param state_file: if not None, the file with the state of the previous run in the output directory, see
+                           save_distance_incremental. The documents of the previous run that are not in the files are
+                           restored from the state, so they are compared with the new documents
+        :param documents: if not None, iterable of (doc element, filename) that are added after the files, for example
+                          a generator that creates the documents without writing them to disk
         """
 
         self.files = files
+        self.similarity_method = similarity
+        self.max_document_frequency = max_document_frequency
+        self.permutations = permutations
+        self.bands = bands
+
+        self.vocabulary = {}  # Interned keys and titles: string -> integer
+        self.state_file = state_file
+        self.previous_state = None
+        if not state_file is None and os.path.isfile( state_file):
+            with open( state_file, "rb") as file:
+                self.previous_state = pickle.load( file)
+            # Use the same integers as the previous run, so the link sets can be compared
+            self.vocabulary = {text: number for (number, text) in enumerate( self.previous_state["vocabulary"])}
+
+        self.texts = TextStore( spill_dir)
+        self.documents = []
+        self.file_fingerprints = {}
+        for file in files:
+            if state_file is None:
+                self.add_document( ET.parse(file).getroot(), os.path.basename( file))
+            else:
+                with open( file, "rb") as input:
+                    data = input.read()
+                self.file_fingerprints[os.path.basename( file)] = hashlib.sha1( data).digest()
+                self.add_document( ET.fromstring( data), os.path.basename( file))
+        for (doc, filename) in (documents if not documents is None else []):
+            if not state_file is None:
+                self.file_fingerprints[filename] = hashlib.sha1( ET.tostring( doc)).digest()
+            self.add_document( doc, filename)
+        self.texts.flush()
+
+        self.read_documents = len(self.documents)  # The documents after these are restored from the state
+        if not self.previous_state is None:
+            self.__restore_documents( os.path.dirname( state_file))
+
+        print(f"Loaded {len(self.documents)} documents, peak memory {functions.peak_memory_mb():.0f} MB")
+
+
+    def __intern(self, text):
+        """
+        Returns the integer for the text
+        :param text:
+        :return:
+        """
+
+        return self.vocabulary.setdefault( text, len(self.vocabulary))
 
 
-    def __jaccard(self, set1, set2):
+    def add_document(self, doc, filename):
         """
-        Calculates the jaccar index between two sets
-        :param set1:
-        :param set2:
+        Add the document to the compact representation: (filename, id, title, sections) where sections is a list
+        of (section id, title, reference to the text, set of interned keys)
+        :param doc: the doc element of a file created by Sections
+        :param filename: name of the output file
         :return:
         """
-        union_length = len(set.union( set1, set2))
-        intersection_length = len(set.intersection( set1, set2))
 
-        if union_length == 0 or intersection_length == 0:
-            return 0
-        elif intersection_length >= 10:
-            return 0.75
-        else:
-            return intersection_length / union_length
+        sections = []
+        for section_elem in doc.iter("section"):
+            sections.append( (section_elem.attrib["id"],
+                              section_elem.find("title").text,
+                              self.texts.add( section_elem.find("text").text),
+                              self.__read_info( section_elem)))
+
+        self.documents.append( (filename, doc.attrib["id"], doc.find("title").text, sections))
+
+
+    def __restore_documents(self, output_dir):
+        """
+        Add the documents of the previous run that are not read again, with their links from the state. They have
+        no texts, their output files are only patched. Documents of which the output file is removed are left out
+        :param output_dir:
+        :return:
+        """
+
+        read = set( self.file_fingerprints.keys())
+        old_links = self.previous_state["links"]
+        restored = 0
+        for (filename, id, title, section_ids) in self.previous_state.get("documents", []):
+            if filename in read or not os.path.isfile( os.path.join( output_dir, filename)):
+                continue
+
+            sections = [(section_id, None, None, set( array.array("q", old_links[section_id]))) for section_id in section_ids]
+            self.documents.append( (filename, id, title, sections))
+            self.file_fingerprints[filename] = self.previous_state["files"][filename]
+            restored += 1
+
+        if restored > 0:
+            print(f"Restored {restored} documents of the previous run")
 
 
     def __jaccard_to_this(self, id):
         """
         Calculates the jaccard index between this and all other documents
         :param id:
-        :param keys_in_id:
-        :return: list of (id, distance)
+        :return: generator of (id, distance)
         """
 
-        distances = []
-        is_section = "_" in id
-        main_id = id.split("_")[0]
+        return self.similarity.distances( id)
+
+
+    def report_recall(self, treshold, sample_size=100):
+        """
+        Prints the recall of the approximation ("minhash") compared to the exact jaccard indexes on a sample
+        :param treshold:
+        :param sample_size: number of articles and sections in the sample
+        :return: the recall
+        """
 
-        for other in self.links_for_id.keys():
-            # Don't compare to yourself
-            if main_id != other.split("_")[0]:
-                # Compare sections with sections and articles with articles
-                if (is_section and "_" in other) or (not is_section and not "_" in other):
-                    index = self.__jaccard(self.links_for_id[id], self.links_for_id[other])
-                    if( index > 0):
-                        distances.append( (other, index))
+        ids = list( self.links_for_id.keys())
+        sample = random.Random( 1).sample( ids, min( sample_size, len(ids)))
+        (recall, total) = self.similarity.recall( InvertedIndexJaccard( self.links_for_id), treshold, sample)
+        print(f"Recall of {self.similarity_method} on {len(sample)} ids: {recall:.3f} ({total} links)")
 
-        return distances
+        return recall
 
 
-    def __create_links(self, parent, distances, treshold):
+    def __create_links(self, parent, distances, treshold, top_k=None):
         """
-        Add link elements to the parent depending on the list of (id, distance) tuples
+        Add link elements to the parent depending on the (id, distance) tuples
         :param parent:
-        :param distances:
+        :param distances: iterable of (id, distance)
+        :param treshold:
+        :param top_k: if not None, only the top_k links with the highest distance are added, highest first
         :return:
         """
 
         links = ET.SubElement(parent, "links")
-        for distance in distances:
-            if( distance[1] >= treshold):
-                link = ET.SubElement(links, "link", attrib={"id": distance[0], "class": "1", "index": str(distance[1])})
+        if top_k is None:
+            selected = (distance for distance in distances if distance[1] >= treshold)
+        else:
+            selected = self.__top_k( distances, treshold, top_k)
+
+        for distance in selected:
+            link = ET.SubElement(links, "link", attrib={"id": distance[0], "class": "1", "index": str(distance[1])})
 
         parent.append(links)
 
 
+    def __top_k(self, distances, treshold, top_k):
+        """
+        Selects the top_k distances above the treshold with a heap of at most top_k elements
+        :param distances: iterable of (id, distance)
+        :param treshold:
+        :param top_k:
+        :return: list of (id, distance) with the highest distance first, equal distances in the original order
+        """
+
+        if top_k < 1:
+            return []
+
+        heap = []  # (distance, -position, id), the lowest distance is on top
+        for (position, (id, distance)) in enumerate( distances):
+            if distance >= treshold:
+                if len(heap) < top_k:
+                    heapq.heappush( heap, (distance, -position, id))
+                elif (distance, -position) > heap[0][:2]:
+                    heapq.heapreplace( heap, (distance, -position, id))
+
+        return [(id, distance) for (distance, position, id) in sorted( heap, reverse=True)]
+
 
-    def __read_info(self, elem, articles):
+
+    def __read_info(self, elem):
         """
-        Returns a set of all links in lowercase
-        :param filename:
+        Returns a set of all links in lowercase, as interned integers
+        :param elem:
         :return: keys
         """
 
@@ -85,11 +215,10 @@ class Links:
         if key_elem is None:  # Always return a list
             keys = []
         else:
-            keys = [ key.text.lower() for key in key_elem.iter("key")]
+            keys = [ self.__intern( key.text.lower()) for key in key_elem.iter("key")]
 
 
         return set(keys)
-        # return set(keys).intersection(articles)
 
 
     def read_name_id(self):
@@ -99,11 +228,8 @@ class Links:
         """
 
         name_id = {}
-        for file in self.files:
-            xml = ET.parse(file)
-            doc = xml.getroot()
-            title = doc.find("title").text
-            name_id[title.lower()] = doc.attrib["id"]
+        for (filename, id, title, sections) in self.documents:
+            name_id[title.lower()] = id
 
         return name_id
 
@@ -131,55 +257,275 @@ class Links:
         outgoing hyperlinks
         """
 
-        articles = set( name_id.keys())
-        self.links_for_id = {}
-        for file in self.files:
-            xml = ET.parse(file)
-            doc = xml.getroot()
-            id = doc.attrib["id"]
+        # The keys are interned, so translate the names to interned integers
+        interned_name_id = {self.__intern( name): id for (name, id) in name_id.items()}
 
+        self.links_for_id = {}
+        for (filename, id, title, sections) in self.documents:
             doc_links = set()
             # The sections
-            for section_elem in doc.iter("section"):
-                subid = section_elem.attrib["id"]
-                links = self.__read_info( section_elem, articles)
-                doc_links = doc_links.union( set(links))
+            for (subid, section_title, text, links) in sections:
+                doc_links = doc_links.union( links)
                 self.links_for_id[subid] = links
 
             # The document
-            name = doc.find("title").text
-            self.add_links_to_document(id, name, doc_links, name_id)
+            self.add_links_to_document(id, self.__intern( title), doc_links, interned_name_id)
+
+        if self.similarity_method == "inverted":
+            self.similarity = InvertedIndexJaccard( self.links_for_id, self.max_document_frequency)
+        elif self.similarity_method == "minhash":
+            self.similarity = MinHashJaccard( self.links_for_id, self.permutations, self.bands)
+        else:
+            # The rows in the order of save_distance: every article followed by its sections
+            order = (id for (filename, doc_id, title, sections) in self.documents for id in [doc_id] + [section[0] for section in sections])
+            self.similarity = SparseJaccard( self.links_for_id, order)
 
 
 
-    def save_distance(self, output_dir, treshold, first_file_index, last_file_index):
+    def save_distance(self, output_dir, treshold, first_file_index, last_file_index, top_k=None):
         """
         Save the links and the distances in a new file with the keys removed and the links added
-        :param output:
+        :param output_dir:
+        :param treshold: minimal distance of a link
+        :param first_file_index:
+        :param last_file_index:
+        :param top_k: if not None, the maximum number of links per article and per section
         :return:
         """
 
-        last = min( last_file_index, len(self.files) - 1)
+        last = min( last_file_index, self.read_documents - 1)
         for i in range( first_file_index, last + 1):
-            file = self.files[i]
-            xml = ET.parse(file)
-            doc = xml.getroot()
+            (filename, id, title, sections) = self.documents[i]
 
             # Compare with all others
-            id = doc.attrib["id"]
-
             nw_doc = ET.Element("doc", attrib={"id": id})
-            ET.SubElement(nw_doc,"title").text = doc.find("title").text
-            self.__create_links(nw_doc, self.__jaccard_to_this(id), treshold)
-
-            for section_elem in list(doc.iter("section")):
-                sectionid = section_elem.attrib["id"]
+            ET.SubElement(nw_doc,"title").text = title
+            self.__create_links(nw_doc, self.__jaccard_to_this(id), treshold, top_k)
 
+            for (sectionid, section_title, text, keys) in sections:
                 nw_sect = ET.SubElement( nw_doc, "section", attrib={"id": sectionid})
-                ET.SubElement(nw_sect, "title").text = section_elem.find("title").text
-                ET.SubElement(nw_sect, "text").text = section_elem.find("text").text
+                ET.SubElement(nw_sect, "title").text = section_title
+                ET.SubElement(nw_sect, "text").text = self.texts.get( text)
 
-                self.__create_links(nw_sect, self.__jaccard_to_this( sectionid), treshold)
+                self.__create_links(nw_sect, self.__jaccard_to_this( sectionid), treshold, top_k)
 
-            filename = os.path.join( output_dir, os.path.basename( file))
+            filename = os.path.join( output_dir, filename)
             functions.write_file(filename, functions.xml_as_string( nw_doc))
+
+
+    def save_distance_parallel(self, output_dir, treshold, workers, top_k=None):
+        """
+        Same as save_distance for all files that are read, but with a number of processes. The links and the similarity are
+        shared with the workers through fork (copy on write), the workers take the next range of files when
+        they are ready so articles with many sections do not hold up the others
+        :param output_dir:
+        :param treshold:
+        :param workers: number of processes
+        :param top_k: see save_distance
+        :return:
+        """
+
+        if workers <= 1 or not "fork" in multiprocessing.get_all_start_methods():
+            self.save_distance( output_dir, treshold, 0, self.read_documents, top_k)
+            return
+
+        size = max(1, math.ceil( self.read_documents / (workers * Links.ranges_per_worker)))
+        ranges = [(output_dir, treshold, first, first + size - 1, top_k) for first in range(0, self.read_documents, size)]
+        if hasattr( self.similarity, "split_chunks"):  # Every chunk is calculated by one worker only
+            self.similarity.split_chunks( [[id for i in range(first, min(first + size, self.read_documents)) for id in self.__ids_of_document( i)]
+                                           for first in range(0, self.read_documents, size)])
+
+        Links.shared = self
+        try:
+            with multiprocessing.get_context("fork").Pool( processes=workers) as pool:
+                for _ in pool.imap_unordered( Links.save_distance_range, ranges):
+                    pass
+        finally:
+            Links.shared = None
+
+
+    @staticmethod
+    def save_distance_range(arguments):
+        """
+        Save the distances of a range of files with the shared Links object, runs in a worker process
+        :param arguments: (output_dir, treshold, first_file_index, last_file_index, top_k)
+        :return:
+        """
+
+        Links.shared.save_distance( *arguments)
+
+
+    def save_distance_incremental(self, output_dir, treshold, workers=1, top_k=None):
+        """
+        Same as save_distance_parallel, but when the state of a previous run with the same parameters is available
+        only new and changed files are written. In the other files, also the files of the restored documents, only
+        the links elements of the articles and sections that have a link set that changed or that share a link with
+        a changed set are replaced. The state of this run, with the restored documents, is saved in the state file
+        :param output_dir:
+        :param treshold:
+        :param workers: number of processes, only used if everything is calculated
+        :param top_k: see save_distance
+        :return:
+        """
+
+        parameters = (self.similarity_method, self.max_document_frequency, self.permutations, self.bands, treshold, top_k)
+        (fingerprints, sorted_links) = self.__link_fingerprints()
+
+        changes = None
+        if not self.previous_state is None and self.previous_state["parameters"] == parameters:
+            changes = self.__changes( output_dir, fingerprints)
+
+        if changes is None:
+            self.save_distance_parallel( output_dir, treshold, workers, top_k)
+            for i in range( self.read_documents, len(self.documents)):  # All links of the restored documents
+                self.__patch_links( output_dir, i, self.__ids_of_document( i), treshold, top_k)
+        else:
+            (files, patches) = changes
+            if hasattr( self.similarity, "select"):
+                ids = [id for i in files for id in self.__ids_of_document( i)] + [id for ids in patches.values() for id in ids]
+                self.similarity.select( ids)
+
+            for i in sorted( files + list( patches.keys())):  # In the order of the rows, see SparseJaccard
+                if i in patches:
+                    self.__patch_links( output_dir, i, patches[i], treshold, top_k)
+                else:
+                    self.save_distance( output_dir, treshold, i, i, top_k)
+            print(f"{len(files)} files written, links changed in {len(patches)} files")
+
+        self.__save_state( parameters, fingerprints, sorted_links)
+
+
+    def __ids_of_document(self, index):
+        """
+        Returns the id of the document and the ids of its sections
+        :param index: index in self.documents
+        :return: list of ids
+        """
+
+        (filename, id, title, sections) = self.documents[index]
+        return [id] + [section[0] for section in sections]
+
+
+    def __link_fingerprints(self):
+        """
+        Calculates a fingerprint of the link set of every id
+        :return: (dictionary id -> fingerprint, dictionary id -> sorted links as bytes)
+        """
+
+        fingerprints = {}
+        sorted_links = {}
+        for (id, links) in self.links_for_id.items():
+            data = array.array("q", sorted( links)).tobytes()
+            sorted_links[id] = data
+            fingerprints[id] = hashlib.sha1( data).digest()
+
+        return (fingerprints, sorted_links)
+
+
+    def __changes(self, output_dir, fingerprints):
+        """
+        Determines what has to be written compared to the previous state
+        :param output_dir:
+        :param fingerprints: the fingerprints of the link sets of this run
+        :return: (list of indexes of documents to be written, dictionary index -> ids with changed links)
+                 or None if it is faster to calculate everything
+        """
+
+        old_fingerprints = self.previous_state["fingerprints"]
+        old_links = self.previous_state["links"]
+
+        # The ids with a changed link set and the links of both the old and the new set
+        changed = set()
+        changed_links = {False: set(), True: set()}  # Articles and sections
+        for (id, fingerprint) in fingerprints.items():
+            if old_fingerprints.get( id) != fingerprint:
+                changed.add( id)
+                changed_links["_" in id].update( self.links_for_id[id])
+                if id in old_links:
+                    changed_links["_" in id].update( array.array("q", old_links[id]))
+        for id in old_fingerprints.keys() - fingerprints.keys():  # Removed ids
+            changed_links["_" in id].update( array.array("q", old_links[id]))
+
+        # Everything that shares a link with a changed set can have other distances
+        affected = set( changed)
+        for (id, links) in self.links_for_id.items():
+            if not id in affected and not changed_links["_" in id].isdisjoint( links):
+                affected.add( id)
+
+        if len(affected) > Links.incremental_fraction * len(self.links_for_id):
+            return None
+
+        files = []
+        patches = {}
+        old_files = self.previous_state["files"]
+        for i in range(0, len(self.documents)):
+            filename = self.documents[i][0]
+            if i < self.read_documents and (old_files.get( filename) != self.file_fingerprints[filename] or not os.path.isfile( os.path.join( output_dir, filename))):
+                files.append( i)
+            else:
+                ids = [id for id in self.__ids_of_document( i) if id in affected]
+                if len(ids) > 0:
+                    patches[i] = ids
+
+        return (files, patches)
+
+
+    def __patch_links(self, output_dir, index, ids, treshold, top_k):
+        """
+        Replace the links elements of the ids in an existing output file
+        :param output_dir:
+        :param index: index in self.documents
+        :param ids: the article and section ids of the document to be replaced
+        :param treshold:
+        :param top_k:
+        :return:
+        """
+
+        filename = os.path.join( output_dir, self.documents[index][0])
+        doc = ET.parse( filename, ET.XMLParser( remove_blank_text=True)).getroot()
+
+        elements = {doc.attrib["id"]: doc}
+        for section in doc.iter("section"):
+            elements[section.attrib["id"]] = section
+
+        for id in ids:
+            parent = elements[id]
+            old_links = parent.find("links")
+            position = parent.index( old_links)
+            parent.remove( old_links)
+            self.__create_links( parent, self.__jaccard_to_this( id), treshold, top_k)
+            parent.insert( position, parent[-1])  # Same place as the old links
+
+        functions.write_file( filename, functions.xml_as_string( doc))
+
+
+    def __save_state(self, parameters, fingerprints, sorted_links):
+        """
+        Save the state for the next incremental run, with all documents: (filename, id, title, section ids)
+        :param parameters: the parameters that influence the links
+        :param fingerprints: dictionary id -> fingerprint of the link set
+        :param sorted_links: dictionary id -> sorted links as bytes
+        :return:
+        """
+
+        state = {
+            "parameters": parameters,
+            "vocabulary": list( self.vocabulary.keys()),  # In the order of the integers
+            "fingerprints": fingerprints,
+            "links": sorted_links,
+            "files": self.file_fingerprints,
+            "documents": [(filename, id, title, [section[0] for section in sections]) for (filename, id, title, sections) in self.documents]
+        }
+
+        with open( self.state_file + ".tmp", "wb") as file:
+            pickle.dump( state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace( self.state_file + ".tmp", self.state_file)
+
+
+    def close(self):
+        """
+        Remove the temporary file with texts
+        :return:
+        """
+
+        self.texts.close()
@@ -0,0 +1,126 @@
+# Class to keep track of the work that is done in the steps of a pipeline
+import hashlib
+import json
+import os
+
+class Manifest:
+    """
+    Records per step and per article that the article is done, with a hash of the input and a hash of the
+    output file. The manifest is kept as JSON in the output directory, so a run that is interrupted can be
+    resumed: an article is only done again if the input changed or the output file is missing or changed.
+    """
+
+    filename = "manifest.json"
+    save_every = 100  # Number of changes after which the manifest is saved
+
+
+    def __init__(self, output_dir, resume=True):
+        """
+        Open the manifest in the output directory
+        :param output_dir:
+        :param resume: if False the existing manifest is ignored
+        """
+
+        self.filename = os.path.join( output_dir, Manifest.filename)
+        self.changes = 0
+        self.steps = {}
+        if resume and os.path.isfile( self.filename):
+            with open( self.filename, "r", encoding="utf-8") as file:
+                self.steps = json.load( file)["steps"]
+
+
+    def is_done(self, step, id, input_hash, output_file):
+        """
+        Returns True if the article is done in the step with the same input and the output file is unchanged
+        :param step: name of the step
+        :param id: the id of the article
+        :param input_hash: hash of the input of the step
+        :param output_file: the file the step creates, not checked if no file was created
+        :return:
+        """
+
+        entry = self.entry( step, id)
+        if entry is None or entry["input"] != input_hash:
+            return False
+        if entry["output"] is None:
+            return True
+
+        return os.path.isfile( output_file) and entry["output"] == Manifest.hash_file( output_file)
+
+
+    def entry(self, step, id):
+        """
+        Returns the entry of the article in the step
+        :param step:
+        :param id:
+        :return: dictionary with "input", "output" and the extra information, None if not done
+        """
+
+        return self.steps.get( step, {}).get( id)
+
+
+    def done(self, step, id, input_hash, output_file, **info):
+        """
+        Record that the article is done in the step
+        :param step: name of the step
+        :param id: the id of the article
+        :param input_hash: hash of the input of the step
+        :param output_file: the file the step creates, None or a file that does not exist if no file was created
+        :param info: extra information that is saved with the entry
+        :return:
+        """
+
+        created = not output_file is None and os.path.isfile( output_file)
+        entry = {"input": input_hash, "output": Manifest.hash_file( output_file) if created else None}
+        entry.update( info)
+        self.steps.setdefault( step, {})[id] = entry
+
+        self.changes += 1
+        if self.changes >= Manifest.save_every:
+            self.save()
+
+
+    def remove_step(self, step):
+        """
+        Forget all articles of the step, for example when the output of the step is removed
+        :param step:
+        :return:
+        """
+
+        self.steps.pop( step, None)
+        self.changes += 1
+
+
+    def save(self):
+        """
+        Write the manifest to disk
+        :return:
+        """
+
+        with open( self.filename + ".tmp", "w", encoding="utf-8") as file:
+            json.dump( {"steps": self.steps}, file)
+        os.replace( self.filename + ".tmp", self.filename)
+        self.changes = 0
+
+
+    @staticmethod
+    def hash(text):
+        """
+        Returns the hash of a text
+        :param text:
+        :return: hexadecimal string
+        """
+
+        return hashlib.sha1( text.encode("utf-8")).hexdigest()
+
+
+    @staticmethod
+    def hash_file(filename):
+        """
+        Returns the hash of the contents of a file
+        :param filename:
+        :return: hexadecimal string
+        """
+
+        with open( filename, "rb") as file:
+            return hashlib.sha1( file.read()).hexdigest()
@@ -0,0 +1,128 @@
+# Class to find similar documents with MinHash signatures and locality sensitive hashing
+import random
+import zlib
+import numpy as np
+import functions
+
+class MinHashJaccard:
+    """
+    Approximates the search for similar articles and sections. Every set of links gets a MinHash signature of
+    "permutations" hash values, the signature is divided in "bands" and documents with the same values in at
+    least one band are candidates. The jaccard index of the candidates is calculated exactly, so only pairs that
+    are not found as a candidate are missed.
+    """
+
+    prime = (1 << 31) - 1  # Modulus of the hash functions
+    seed = 1               # Seed for the hash functions, so the results can be reproduced
+
+
+    def __init__(self, links_for_id, permutations=128, bands=32):
+        """
+        Create the signatures and the buckets of the bands
+        :param links_for_id: dictionary with the id as key and a set of links as value, ids with an "_" are sections
+        :param permutations: number of hash functions in a signature
+        :param bands: number of bands, permutations must be a multiple of bands
+        """
+
+        if permutations % bands != 0:
+            raise ValueError(f"The number of permutations ({permutations}) must be a multiple of the number of bands ({bands})")
+
+        self.links_for_id = links_for_id
+        self.bands = bands
+        self.rows_per_band = permutations // bands
+
+        generator = random.Random( MinHashJaccard.seed)
+        self.a = np.array( [generator.randrange(1, MinHashJaccard.prime) for _ in range(permutations)], dtype=np.int64)
+        self.b = np.array( [generator.randrange(0, MinHashJaccard.prime) for _ in range(permutations)], dtype=np.int64)
+
+        self.groups = {}
+        self.group_of_id = {}
+        for is_section in [False, True]:
+            ids = [id for id in links_for_id.keys() if ("_" in id) == is_section]  # In the order of the dictionary
+            signatures = np.empty( (len(ids), permutations), dtype=np.int64)
+            buckets = [{} for _ in range(bands)]
+            for (row, id) in enumerate( ids):
+                self.group_of_id[id] = (is_section, row)
+                signatures[row] = self.__signature( links_for_id[id])
+                if len(links_for_id[id]) > 0:  # Empty sets are not similar to anything
+                    for (band, key) in enumerate( self.__band_keys( signatures[row])):
+                        buckets[band].setdefault( key, []).append( row)
+
+            self.groups[is_section] = {
+                "ids": ids,
+                "main": [id.split("_")[0] for id in ids],
+                "signatures": signatures,
+                "buckets": buckets
+            }
+
+
+    def __signature(self, links):
+        """
+        Calculates the MinHash signature of a set of links
+        :param links:
+        :return: array with the minimum of every hash function
+        """
+
+        if len(links) == 0:
+            return np.full( len(self.a), MinHashJaccard.prime, dtype=np.int64)
+
+        hashes = np.array( [zlib.crc32( str(link).encode("utf-8")) % MinHashJaccard.prime for link in links], dtype=np.int64)
+        return ((np.outer( self.a, hashes) + self.b[:, None]) % MinHashJaccard.prime).min( axis=1)
+
+
+    def __band_keys(self, signature):
+        """
+        Returns the keys of the bands of a signature
+        :param signature:
+        :return: list of bytes
+        """
+
+        return [signature[band * self.rows_per_band:(band + 1) * self.rows_per_band].tobytes() for band in range(self.bands)]
+
+
+    def distances(self, id):
+        """
+        Calculates the jaccard index between this and the candidate documents (articles with articles and sections
+        with sections), but not with the sections of the same article
+        :param id:
+        :return: generator of (id, distance) for all distances above zero, in the order of the links dictionary
+        """
+
+        (is_section, row) = self.group_of_id[id]
+        group = self.groups[is_section]
+        links = self.links_for_id[id]
+        if len(links) == 0:
+            return
+
+        candidates = set()
+        for (band, key) in enumerate( self.__band_keys( group["signatures"][row])):
+            candidates.update( group["buckets"][band][key])
+
+        main_id = group["main"][row]
+        for other in sorted( candidates):
+            if group["main"][other] != main_id:  # Don't compare to yourself
+                other_links = self.links_for_id[group["ids"][other]]
+                intersection_length = len( links & other_links)
+                index = functions.jaccard_index( intersection_length, len(links) + len(other_links) - intersection_length)
+                if index > 0:
+                    yield (group["ids"][other], index)
+
+
+    def recall(self, exact, treshold, ids):
+        """
+        Calculates the fraction of the links above the treshold of the exact method that are also found by MinHash
+        :param exact: object with a distances method that calculates the exact jaccard indexes
+        :param treshold:
+        :param ids: the ids to be compared
+        :return: (recall, number of exact links)
+        """
+
+        found = 0
+        total = 0
+        for id in ids:
+            expected = set( other for (other, index) in exact.distances( id) if index >= treshold)
+            approximated = set( other for (other, index) in self.distances( id) if index >= treshold)
+            total += len(expected)
+            found += len(expected & approximated)
+
+        return ((found / total) if total > 0 else 1.0, total)
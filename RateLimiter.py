@@ -0,0 +1,115 @@
+# Class to keep the queries of a client within the limits of a server
+import email.utils
+import threading
+import time
+
+class RateLimiter:
+    """
+    Token buckets for the limits of a server per period, for example of the WikiData query service:
+        - 60 seconds of processing time each 60 seconds
+        - 30 error queries per minute
+    The processing time of a query is taken from the budget after the query, so the budget can become negative;
+    the next query then waits until the budget is positive again. A Retry-After from the server blocks all queries
+    until that time. Only waits if a budget requires it.
+    """
+
+    def __init__(self, processing_seconds=60.0, errors=30, period=60.0, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param processing_seconds: processing time that is allowed per period
+        :param errors: number of errors that are allowed per period
+        :param period: the period in seconds
+        :param clock: function that returns the time in seconds
+        :param sleep: function that waits a number of seconds
+        """
+
+        self.processing_seconds = processing_seconds
+        self.errors = errors
+        self.period = period
+        self.clock = clock
+        self.sleep = sleep
+
+        self.processing_budget = processing_seconds
+        self.error_budget = float(errors)
+        self.blocked_until = 0.0
+        self.updated = clock()
+        self.lock = threading.Lock()  # Queries can be performed from several threads
+
+
+    def __refill(self):
+        """
+        Add the budget of the time since the last update, must be called with the lock
+        :return: the current time
+        """
+
+        now = self.clock()
+        elapsed = max(0.0, now - self.updated)
+        self.processing_budget = min( self.processing_seconds, self.processing_budget + elapsed * self.processing_seconds / self.period)
+        self.error_budget = min( float(self.errors), self.error_budget + elapsed * self.errors / self.period)
+        self.updated = now
+
+        return now
+
+
+    def wait(self):
+        """
+        Wait until a query is allowed: there is processing time left, the query is allowed to fail and the
+        server does not block the queries
+        :return: the number of seconds that was waited
+        """
+
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = self.__refill()
+                delay = max( self.blocked_until - now,
+                             -self.processing_budget * self.period / self.processing_seconds,
+                             (1.0 - self.error_budget) * self.period / self.errors)
+            if delay <= 0:
+                return waited
+
+            self.sleep( delay)
+            waited += delay
+
+
+    def done(self, duration, error=False, retry_after=None):
+        """
+        Record a query that is performed
+        :param duration: the processing time of the query in seconds
+        :param error: True if the query failed
+        :param retry_after: None or the value of the Retry-After header of the response
+        :return:
+        """
+
+        with self.lock:
+            now = self.__refill()
+            self.processing_budget -= duration
+            if error:
+                self.error_budget -= 1.0
+
+            delay = RateLimiter.parse_retry_after( retry_after)
+            if not delay is None:
+                self.blocked_until = max( self.blocked_until, now + delay)
+                self.processing_budget = min( self.processing_budget, 0.0)  # The server says we use too much
+
+
+    @staticmethod
+    def parse_retry_after(value):
+        """
+        Returns the number of seconds to wait according to a Retry-After header
+        :param value: None, a number of seconds or a http date
+        :return: None if there is no (valid) value, else the number of seconds
+        """
+
+        if value is None:
+            return None
+
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+
+        try:
+            date = email.utils.parsedate_to_datetime( value)
+        except (TypeError, ValueError):
+            return None
+
+        return max(0.0, date.timestamp() - time.time())
@@ -3,20 +3,29 @@ from lxml import etree as ET
 import functions
 import os
 import re
+import string
 import wikitextparser as wtp
 
 class Sections:
 
-    sections_to_exclude = [section.lower() for section in functions.read_lines_from_file("sections_to_exclude.txt")]
+    articles_per_task = 16  # Number of articles that a worker process splits at once
+    cache_version = 1       # Version of the parsed articles in the ArticleCache, change it if the parsing changes
 
-    def __init__(self, contents):
+    exclude_filename = os.path.join( os.path.dirname( os.path.abspath( __file__)), "sections_to_exclude.txt")
+    excluded_titles = None  # Language -> frozenset of normalized titles, read at the first use
+
+    def __init__(self, contents, cache=None, language=None):
         """
         Create a sections object
         :param contents: Xml contents
+        :param cache: None or the ArticleCache of the dump the article comes from
+        :param language: language code of the article, used for the sections to exclude
         """
 
         self.xml = ET.fromstring( contents)
         self.contents = contents
+        self.cache = cache
+        self.language = language
 
 
     def __get_tekst(self, part):
@@ -47,17 +56,16 @@ class Sections:
 
 
 
-    def __get_keys(self, part):
+    def __get_keys(self, targets):
         """
         Returns a list of links to other articles that can be used as keys for this article in the "keys" element
-        :param part:
+        :param targets: the targets of the links of the part of the article
         :return:
         """
 
         keys = ET.Element("keys")
-        for link in part.wikilinks:
-            if not ":" in link:
-                ET.SubElement( keys, "key").text = link.target
+        for target in targets:
+            ET.SubElement( keys, "key").text = target
 
         return keys
 
@@ -99,78 +107,186 @@ class Sections:
         :param id
         :return: the number of sections without the main section and the number of sections in a tuple (xml, nrofsections)
         """
-        text = self.xml.find("text").text
+
+        (doc, nrofsections) = self.create_sections_element( with_keys, links, id)
+        return (functions.xml_as_string(doc), nrofsections)
+
+
+    def create_sections_element(self, with_keys, links, id):
+        """
+        Same as create_sections_xml, but returns the doc element instead of the xml
+        :param with_keys:
+        :param links:
+        :param id:
+        :return: tuple (doc element, nrofsections)
+        """
         title = self.xml.find("title").text
-        page = wtp.parse( text)
+        (section_texts, keys) = self.__parsed_article()
 
         # The main part of the Xml
         doc = ET.Element("doc", attrib={"id": id})
         ET.SubElement( doc, "title").text = title
         if with_keys:
-            doc.append( self.__get_keys(page))
+            doc.append( self.__get_keys( [key for keys_of_span in keys for key in keys_of_span]))
         else:
             doc.append( self.__get_links(links))
 
         # Now per section
+        excluded_titles = Sections.excluded_titles_of( self.language)
         id_counter = 1
-        for section in page.sections:
-
-            section_text = self.clean_wiki_text(section.plain_text())
-
+        for (i, (section_text, last)) in enumerate( section_texts):
             if( id_counter > 1): # Split if this is not the first section
                 (section_title, section_text) = self.__split_text_and_title(section_text)
             else:
                 section_title = ""
                 section_text = section_text
 
-            if not section_title.lower() in Sections.sections_to_exclude and len(section_text) > 10:
+            if not Sections.normalize_title( section_title) in excluded_titles and len(section_text) > 10:
                 section_elem = ET.SubElement(doc, "section", attrib={"id": f"{id}_{id_counter:02}"})
                 ET.SubElement(section_elem, "title").text = section_title
                 if with_keys:
-                    section_elem.append(self.__get_keys(section))
+                    section_elem.append(self.__get_keys( [key for keys_of_span in keys[i:last + 1] for key in keys_of_span]))
                 else:
                     section_elem.append(self.__get_links([]))
                 ET.SubElement(section_elem, "text").text = section_text
 
                 id_counter += 1
 
-        return (functions.xml_as_string(doc), id_counter )
+        return (doc, id_counter )
+
+
+
+    def __parsed_article(self):
+        """
+        Returns the parsed text of the article, from the cache if possible
+        :return: see __parse
+        """
+
+        page_id = self.xml.findtext("pageid")
+        revision_id = self.xml.findtext("revisionid")
+        if self.cache is None or page_id is None or revision_id is None:
+            return self.__parse( self.xml.find("text").text)
 
+        cached = self.cache.get( page_id, revision_id)
+        if not cached is None and cached[0] == Sections.cache_version:
+            return cached[1]
 
+        parsed = self.__parse( self.xml.find("text").text)
+        self.cache.put( page_id, revision_id, (Sections.cache_version, parsed))
+        return parsed
 
-    # Regular expression for clean_wiki_text
+
+    def __parse(self, text):
+        """
+        Parse the wikitext of the article. A section contains its subsections, so the text is split in spans that
+        do not overlap (the part of a section before the next section starts) and every span is converted only once
+        :param text:
+        :return: (list with (cleaned text, index of the last span) for every section, list with the keys of every span)
+        """
+
+        # The sections without their subsections, the first section is the lead section with level 0
+        sections = wtp.parse( text).get_sections( include_subsections=False)
+        starts = [section.span[0] for section in sections] + [len(text)]
+        levels = [section.level for section in sections]
+        plain_texts = [section.plain_text() for section in sections]
+        keys = [[link.target for link in section.wikilinks if not ":" in link] for section in sections]
+
+        section_texts = []
+        for i in range(0, len(levels)):
+            # The spans of the section and its subsections, the lead section (the first span) has no subsections
+            last = i
+            while i > 0 and last + 1 < len(levels) and levels[last + 1] > levels[i]:
+                last += 1
+
+            section_texts.append( (self.clean_wiki_text( "".join( plain_texts[i:last + 1])), last))
+
+        return (section_texts, keys)
+
+
+    # Regular expressions for clean_wiki_text
     curly_braces_re = re.compile(r"\{[^}]+}")
-    category_re = re.compile(r"^Category:.*?$", flags=re.MULTILINE | re.IGNORECASE)
-    file_re = re.compile(r"^File:.*?$", flags=re.MULTILINE | re.IGNORECASE)
-    white_spaces_re = re.compile(r"[ \t]+")
+    categories_and_files_re = re.compile(r"^(?:category|file):.*", flags=re.MULTILINE | re.IGNORECASE)
+    # List items and lines with only white space, including the newline
+    skip_lines_re = re.compile(r"^(?:[^\S\n]*[#*].*|[ \t]*)(?:\n|\Z)", flags=re.MULTILINE)
+    # White space that is not a single space
+    white_spaces_re = re.compile(r" [ \t]+|\t[ \t]*")
 
     def clean_wiki_text(self, text):
         """
-        Clean the text coming from wikipedia
+        Clean the text coming from wikipedia, every step is a single pass over the text
         :param self:
         :param text:
         :return:
         """
         clean = Sections.curly_braces_re.sub("", text)  # Remove everyting between curly braces
-        clean = Sections.category_re.sub("", clean)  # Remove the categories
-        clean = Sections.file_re.sub("", clean)  # Remove the categories
+        clean = Sections.categories_and_files_re.sub("", clean)  # Remove the categories and files
         clean = clean.replace("=====", "")
         clean = clean.replace("====", "")
         clean = clean.replace("===", "")
         clean = clean.replace("==", "")
 
-        # Remove white spaces and list items
-        not_list_item_or_empty_lines = [line for line in clean.split("\n") if
-                                            not line.strip().startswith("#")
-                                            and not line.strip().startswith("*")
-                                            and Sections.white_spaces_re.sub("", line) != ""]
-        clean = "\n".join(not_list_item_or_empty_lines)
+        # Remove the list items and empty lines, if the last line is removed the newline before it is left
+        clean = Sections.skip_lines_re.sub("", clean)
+        if clean.endswith("\n"):
+            clean = clean[:-1]
 
         # Remove the double spaces
         clean = Sections.white_spaces_re.sub(" ", clean)
 
         return clean
 
+    @staticmethod
+    def normalize_title(title):
+        """
+        Normalize the title of a section to compare it with the titles to exclude: case folded, without
+        punctuation at the start and the end and with single spaces
+        :param title:
+        :return:
+        """
+
+        return " ".join( title.strip( string.punctuation + string.whitespace).casefold().split())
+
+
+    @staticmethod
+    def excluded_titles_of(language):
+        """
+        Returns the titles of the sections that are excluded for the language. The file is read once per process,
+        worker processes that are forked after the first use share the titles
+        :param language: language code, None or a language that is not in the file gives the titles of all languages
+        :return: frozenset of normalized titles
+        """
+
+        if Sections.excluded_titles is None:
+            Sections.excluded_titles = Sections.read_excluded_titles( Sections.exclude_filename)
+
+        return Sections.excluded_titles.get( language, Sections.excluded_titles[None])
+
+
+    @staticmethod
+    def read_excluded_titles(filename):
+        """
+        Read the titles of the sections to exclude, the titles of a language follow a line with the language
+        code between brackets, for example "[en]". Titles before the first language are excluded for all languages
+        :param filename:
+        :return: dictionary with the language as key and a frozenset of normalized titles as value, the key None has the titles of all languages
+        """
+
+        titles = {None: set()}
+        language = None
+        for line in functions.read_lines_from_file( filename):
+            if line.startswith("[") and line.endswith("]"):
+                language = line[1:-1].strip().lower()
+                titles.setdefault( language, set())
+            else:
+                titles[language].add( Sections.normalize_title( line))
+
+        common = titles.pop( None)
+        excluded = {language: frozenset( common | language_titles) for (language, language_titles) in titles.items()}
+        excluded[None] = frozenset( common.union( *titles.values()))
+
+        return excluded
+
+
     def create_sections(self, with_keys, links, id, output_dir):
         """
         Create sections into the output dir
@@ -187,3 +303,38 @@ class Sections:
         functions.write_file(filename, xml )
 
         return nrofsections
+
+
+
+    @staticmethod
+    def create_sections_of_files(filenames, output_dir, cache=None, language=None):
+        """
+        Create the sections of the articles in the files of step 1, runs in a worker process
+        :param filenames: xml files of the articles, the name of the file is the id
+        :param output_dir:
+        :param cache: None or an ArticleCache
+        :param language: language code of the articles
+        :return: list with the result of create_sections of every file
+        """
+
+        numbers = []
+        for filename in filenames:
+            id = os.path.splitext( os.path.basename( filename))[0]
+            sections = Sections( functions.read_file( filename), cache, language)
+            numbers.append( sections.create_sections( with_keys=True, links=[], id=id, output_dir=output_dir))
+
+        return numbers
+
+
+    @staticmethod
+    def create_sections_of_articles(articles, output_dir, cache=None, language=None):
+        """
+        Create the sections of articles with the given links, runs in a worker process
+        :param articles: list of (id, xml, links)
+        :param output_dir:
+        :param cache: None or an ArticleCache
+        :param language: language code of the articles
+        :return: list with the result of create_sections of every article
+        """
+
+        return [Sections( xml, cache, language).create_sections( with_keys=False, links=links, id=id, output_dir=output_dir) for (id, xml, links) in articles]
@@ -61,13 +61,20 @@ def save_articles(wikidata, lemmata, count, id_prefix, output):
 
     written = []
 
-    for i in range(0, len(lemmata)):
-        if len( written)  < count:
-            id = f"{id_prefix}_{i + 1}"  # Dummy id
-
-            xml = wikidata.read_wikipedia_article(id, lemmata[i])
+    # Read the articles in chunks of the number that is still needed, so the same lemmata are used as when
+    # reading them one by one
+    position = 0
+    while len( written) < count and position < len(lemmata):
+        chunk = range(position, min(position + count - len( written), len(lemmata)))
+        position = chunk.stop
+
+        articles = [(f"{id_prefix}_{i + 1}", lemmata[i]) for i in chunk]  # Dummy id
+        xmls = {id: xml for (id, lemma, xml) in wikidata.read_wikipedia_articles(articles)}
+
+        for (id, lemma) in articles:
+            xml = xmls.get(id)
             if not xml is None:
-                sections = Sections( contents=xml)
+                sections = Sections( contents=xml, language=wikidata.language)
                 (xml, nrofsections) = sections.create_sections_xml(with_keys=False, links=[], id=id)
 
                 # Skip the short lemmata
@@ -75,7 +82,7 @@ def save_articles(wikidata, lemmata, count, id_prefix, output):
                     filename = os.path.join(output, f"{id}.xml")
                     functions.write_file(filename, xml)
 
-                    written.append( lemmata[i])
+                    written.append( lemma)
 
     functions.write_corpus_info(output, "Random " + wikidata.language.upper(), "en")
     return written
@@ -185,3 +192,5 @@ if __name__ == '__main__':
     random_en = enwiki.get_random_articles( exceptions=(a_articles + simple_articles), count=(10 * number_of_random_articles), only_starting_with_a=False)
     save_articles(enwiki, random_en, number_of_random_articles, "r", english)
 
+    print( f"simple {simplewiki.block_cache.statistics()}")
+    print( f"en {enwiki.block_cache.statistics()}")
@@ -0,0 +1,164 @@
+# Class to keep the results of SPARQL queries in one SQLite file
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import functions
+
+class SparqlCache:
+    """
+    Cache of query results in one SQLite database. The results are stored compressed with the query, the time
+    they were created and the time they were last used. Results older than ttl are not returned, when the size of
+    the results is above max_bytes the least recently used results are removed. The json files of the previous
+    cache (one file per query) are imported when the database is created.
+    """
+
+    evict_fraction = 0.9  # After removing results the cache has this fraction of max_bytes
+    version = 1           # Stored as user_version of the database, 0 means the json files are not imported yet
+
+
+    def __init__(self, filename, ttl=None, max_bytes=None):
+        """
+        Open or create the cache
+        :param filename: the SQLite file
+        :param ttl: number of seconds a result is valid, None for no limit
+        :param max_bytes: maximum size of the compressed results, None for no limit
+        """
+
+        self.filename = filename
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+        self.lock = threading.Lock()  # The connection is shared by the threads of WDSparql.query_chunks
+        self.connection = sqlite3.connect( filename, check_same_thread=False)
+        with self.connection:
+            self.connection.execute( "PRAGMA journal_mode=WAL")
+            self.connection.execute( """CREATE TABLE IF NOT EXISTS results (
+                                            key TEXT PRIMARY KEY,
+                                            query TEXT,
+                                            payload BLOB NOT NULL,
+                                            size INTEGER NOT NULL,
+                                            created REAL NOT NULL,
+                                            used REAL NOT NULL)""")
+            self.connection.execute( "CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+
+        if self.connection.execute( "PRAGMA user_version").fetchone()[0] < SparqlCache.version:
+            self.import_json_files( os.path.dirname( filename))
+            self.connection.execute( f"PRAGMA user_version = {SparqlCache.version}")
+
+
+    def get(self, key):
+        """
+        Returns the cached result
+        :param key:
+        :return: the result as text or None if it is not in the cache or expired
+        """
+
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute( "SELECT payload, created FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if not self.ttl is None and row[1] + self.ttl < now:
+                with self.connection:
+                    self.connection.execute( "DELETE FROM results WHERE key = ?", (key,))
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            with self.connection:
+                self.connection.execute( "UPDATE results SET used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+
+        return zlib.decompress( row[0]).decode("utf-8")
+
+
+    def put(self, key, query, result):
+        """
+        Add the result of a query to the cache
+        :param key:
+        :param query: the sparql query, only stored for reference
+        :param result: the result as text
+        :return:
+        """
+
+        payload = zlib.compress( result.encode("utf-8"))
+        now = time.time()
+        with self.lock:
+            with self.connection:
+                self.connection.execute( "INSERT OR REPLACE INTO results (key, query, payload, size, created, used) VALUES (?, ?, ?, ?, ?, ?)",
+                                         (key, query, payload, len(payload), now, now))
+                if not self.max_bytes is None:
+                    self.__evict()
+
+
+    def __evict(self):
+        """
+        Remove the least recently used results until the size is below evict_fraction of the maximum, must be
+        called with the lock in a transaction
+        :return:
+        """
+
+        size = self.connection.execute( "SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if size <= self.max_bytes:
+            return
+
+        keys = []
+        for (key, result_size) in self.connection.execute( "SELECT key, size FROM results ORDER BY used"):
+            if size <= SparqlCache.evict_fraction * self.max_bytes:
+                break
+            keys.append( (key,))
+            size -= result_size
+
+        self.connection.executemany( "DELETE FROM results WHERE key = ?", keys)
+        self.evicted += len(keys)
+
+
+    def import_json_files(self, directory):
+        """
+        Import the json files of the previous cache, the name of a file is the key and the query is in "sparq"
+        :param directory:
+        :return: the number of imported files
+        """
+
+        imported = 0
+        with self.lock:
+            with self.connection:
+                for filename in glob.glob( os.path.join( directory, "*.json")):
+                    key = os.path.splitext( os.path.basename( filename))[0]
+                    contents = functions.read_file( filename)
+                    try:
+                        query = json.loads( contents).get("sparq")
+                    except ValueError:  # Damaged file, the query is done again
+                        continue
+
+                    payload = zlib.compress( contents.encode("utf-8"))
+                    created = os.path.getmtime( filename)
+                    self.connection.execute( "INSERT OR IGNORE INTO results (key, query, payload, size, created, used) VALUES (?, ?, ?, ?, ?, ?)",
+                                             (key, query, payload, len(payload), created, created))
+                    imported += 1
+
+        return imported
+
+
+    def statistics(self):
+        """
+        Returns a line with the statistics of the cache
+        :return:
+        """
+
+        with self.lock:
+            (results, size) = self.connection.execute( "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+
+        total = self.hits + self.misses
+        ratio = (self.hits / total) if total > 0 else 0
+        return (f"SPARQL cache {self.filename}: {results} results, {size / (1024 * 1024):.1f} MB, {self.hits} hits, "
+                f"{self.misses} misses ({ratio:.1%} hits), {self.expired} expired, {self.evicted} evicted")
@@ -0,0 +1,185 @@
+# Class to calculate the jaccard index between the links of documents with sparse matrices
+import bisect
+from collections import OrderedDict
+import numpy as np
+from scipy import sparse
+
+class SparseJaccard:
+    """
+    Calculates the jaccard index between all articles and between all sections. The link targets are mapped
+    to columns of a sparse incidence matrix (one for the articles and one for the sections), the intersections
+    are calculated with a sparse matrix product for a chunk of rows at a time.
+    """
+
+    rows_per_chunk = 1000  # Maximum number of rows that are multiplied at once
+    cached_chunks = 1      # Number of calculated chunks that are kept per group, the rows are used in order
+
+
+    def __init__(self, links_for_id, order=None):
+        """
+        Create the incidence matrices
+        :param links_for_id: dictionary with the id as key and a set of links as value, ids with an "_" are sections
+        :param order: None or the ids in the order in which distances is called. The rows are numbered in this
+                      order, so every chunk is calculated once. The distances are in the order of the dictionary
+        """
+
+        position_of_id = {id: position for (position, id) in enumerate( links_for_id.keys())}
+        ordered = list( links_for_id.keys()) if order is None else [id for id in order if id in position_of_id]
+        if len(ordered) < len(position_of_id):  # Ids that are not in the order come last
+            in_order = set( ordered)
+            ordered.extend( id for id in links_for_id.keys() if not id in in_order)
+
+        columns = {}
+        main_ids = {}
+        self.groups = {}
+        self.group_of_id = {}
+        for is_section in [False, True]:
+            ids = [id for id in ordered if ("_" in id) == is_section]
+            indptr = [0]
+            indices = []
+            for id in ids:
+                for link in links_for_id[id]:
+                    indices.append( columns.setdefault( link, len(columns)))
+                indptr.append( len(indices))
+
+            self.groups[is_section] = {
+                "ids": ids,
+                "indptr": indptr,
+                "indices": indices,
+                "main": np.array( [main_ids.setdefault( id.split("_")[0], len(main_ids)) for id in ids], dtype=np.int64),
+                "position": np.array( [position_of_id[id] for id in ids], dtype=np.int64),  # Row -> position in the dictionary
+                "chunks": OrderedDict(),  # Number of the chunk -> results
+                "starts": list( range(0, len(ids), SparseJaccard.rows_per_chunk)),  # First position of every chunk
+                "rows": None,             # The selected rows, None is all rows
+                "positions": None         # Row -> position in the selected rows
+            }
+            for (row, id) in enumerate( ids):
+                self.group_of_id[id] = (is_section, row)
+
+        for group in self.groups.values():
+            data = np.ones( len(group["indices"]), dtype=np.int64)
+            matrix = sparse.csr_matrix( (data, np.array( group["indices"], dtype=np.int64), np.array( group["indptr"], dtype=np.int64)),
+                                        shape=(len(group["ids"]), max(1, len(columns))))
+            matrix.sum_duplicates()
+            group["matrix"] = matrix
+            group["transposed"] = matrix.T.tocsr()
+            group["sizes"] = np.asarray( matrix.sum( axis=1)).ravel()
+            del group["indptr"], group["indices"]
+
+
+    def select(self, ids):
+        """
+        Only calculate the jaccard indexes of the given ids, distances may only be called for these ids. The
+        chunks are made of the selected rows, so for a small selection no complete chunks are calculated
+        :param ids:
+        :return:
+        """
+
+        for group in self.groups.values():
+            group["rows"] = []
+        for id in ids:
+            (is_section, row) = self.group_of_id[id]
+            self.groups[is_section]["rows"].append( row)
+
+        for group in self.groups.values():
+            group["rows"] = np.array( sorted( set( group["rows"])), dtype=np.int64)
+            group["positions"] = {row: position for (position, row) in enumerate( group["rows"].tolist())}
+            group["starts"] = list( range(0, len(group["rows"]), SparseJaccard.rows_per_chunk))
+            group["chunks"].clear()
+
+
+    def split_chunks(self, ranges):
+        """
+        Let the chunks end where the ranges end, so when the ranges are handled by different processes every
+        chunk is calculated by one process only. Ranges with more than rows_per_chunk rows have several chunks.
+        Not for selected rows
+        :param ranges: lists of ids that are used together, in the order of the rows
+        :return:
+        """
+
+        for (is_section, group) in self.groups.items():
+            starts = {0}
+            for ids in ranges:
+                rows = [row for (id_is_section, row) in (self.group_of_id[id] for id in ids) if id_is_section == is_section]
+                if len(rows) > 0:
+                    starts.update( range(rows[0], rows[-1] + 1, SparseJaccard.rows_per_chunk))
+                    starts.add( rows[-1] + 1)  # The rows after the range are not in its chunk
+
+            group["starts"] = sorted( start for start in starts if start < len(group["ids"]))
+            group["chunks"].clear()
+
+
+    def distances(self, id):
+        """
+        Calculates the jaccard index between this and all other documents (articles with articles and sections
+        with sections), but not with the sections of the same article
+        :param id:
+        :return: generator of (id, distance) for all distances above zero, in the order of the links dictionary
+        """
+
+        (is_section, row) = self.group_of_id[id]
+        group = self.groups[is_section]
+        position = row if group["rows"] is None else group["positions"][row]
+        starts = group["starts"]
+        chunk = bisect.bisect_right( starts, position) - 1
+        chunks = group["chunks"]
+        if chunk in chunks:
+            chunks.move_to_end( chunk)
+        else:
+            last = starts[chunk + 1] if chunk + 1 < len(starts) else len(group["ids"] if group["rows"] is None else group["rows"])
+            chunks[chunk] = self.__calculate_chunk( group, starts[chunk], last)
+            if len(chunks) > SparseJaccard.cached_chunks:
+                chunks.popitem( last=False)
+
+        (others, indexes) = chunks[chunk][position - starts[chunk]]
+        return ((group["ids"][other], float(index)) for (other, index) in zip( others, indexes))
+
+
+    def __calculate_chunk(self, group, first, last):
+        """
+        Calculate the jaccard indexes for all (selected) rows in the chunk
+        :param group:
+        :param first: position of the first row of the chunk
+        :param last: position after the last row of the chunk
+        :return: list with a tuple (other rows, indexes) for every row in the chunk
+        """
+
+        if group["rows"] is None:
+            rows = range(first, last)
+            intersections = (group["matrix"][first:last] @ group["transposed"]).tocsr()
+        else:
+            rows = group["rows"][first:last]
+            intersections = (group["matrix"][rows] @ group["transposed"]).tocsr()
+        intersections.sort_indices()
+
+        results = []
+        for (position, row) in enumerate( rows):
+            start = intersections.indptr[position]
+            end = intersections.indptr[position + 1]
+            others = intersections.indices[start:end]
+            intersection_lengths = intersections.data[start:end]
+            union_lengths = group["sizes"][row] + group["sizes"][others] - intersection_lengths
+
+            keep = (group["main"][others] != group["main"][row]) & (intersection_lengths > 0)  # Don't compare to yourself
+            others = others[keep]
+            indexes = self.__jaccard( intersection_lengths[keep], union_lengths[keep])
+
+            in_dictionary_order = np.argsort( group["position"][others], kind="stable")
+            others = others[in_dictionary_order]
+            indexes = indexes[in_dictionary_order]
+
+            results.append( (others, indexes))
+
+        return results
+
+
+    def __jaccard(self, intersection_lengths, union_lengths):
+        """
+        Calculates the jaccard indexes for arrays of intersection and union lengths with the same rules
+        as functions.jaccard_index, the intersection lengths are above zero
+        :param intersection_lengths:
+        :param union_lengths:
+        :return: array of indexes
+        """
+
+        return np.where( intersection_lengths >= 10, 0.75, intersection_lengths / union_lengths)
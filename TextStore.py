@@ -0,0 +1,84 @@
+# Class to keep texts in memory or in a file on disk
+import os
+import tempfile
+
+class TextStore:
+    """
+    Stores texts and returns a reference to get them back. Without a directory the texts are kept in memory,
+    with a directory they are written to a temporary file and only the position and length are kept.
+    """
+
+    def __init__(self, spill_dir=None):
+        """
+        :param spill_dir: directory for the temporary file, None keeps the texts in memory
+        """
+
+        self.spill_dir = spill_dir
+        self.filename = None
+        self.size = 0
+        self.reader = None
+        self.reader_pid = None
+        if not spill_dir is None:
+            os.makedirs( spill_dir, exist_ok=True)
+            (handle, self.filename) = tempfile.mkstemp( prefix="texts", suffix=".tmp", dir=spill_dir)
+            self.writer = os.fdopen( handle, "wb")
+
+
+    def add(self, text):
+        """
+        Store the text
+        :param text: the text or None
+        :return: reference for get
+        """
+
+        if self.filename is None or text is None:
+            return text
+
+        data = text.encode("utf-8")
+        reference = (self.size, len(data))
+        self.writer.write( data)
+        self.size += len(data)
+
+        return reference
+
+
+    def flush(self):
+        """
+        Write the buffered texts to the file, must be called after the last add
+        :return:
+        """
+
+        if not self.filename is None:
+            self.writer.flush()
+
+
+    def get(self, reference):
+        """
+        Returns the text that was stored
+        :param reference: the reference returned by add
+        :return: the text
+        """
+
+        if self.filename is None or reference is None:
+            return reference
+
+        if self.reader_pid != os.getpid():  # Every (forked) process needs its own file position
+            self.reader = open( self.filename, "rb")
+            self.reader_pid = os.getpid()
+
+        self.reader.seek( reference[0])
+        return self.reader.read( reference[1]).decode("utf-8")
+
+
+    def close(self):
+        """
+        Remove the temporary file
+        :return:
+        """
+
+        if not self.filename is None:
+            self.writer.close()
+            if not self.reader is None:
+                self.reader.close()
+            os.remove( self.filename)
+            self.filename = None
@@ -2,7 +2,6 @@
 # run as: wikidatacorpus.py -s <subject> -o <outputdirectory>
 import math
 import sys,argparse
-import threading
 
 import Sections
 import functions
@@ -10,24 +9,58 @@ from Wikidata import Wikidata
 from Sections import Sections
 from GWikiMatch import GWikiMatch
 from Links import Links
+from Manifest import Manifest
+from ArticleCache import ArticleCache
+from WikiDataSparql import WDSparql
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import os
 
 # Constants
 wikidata_enpoint = "https://query.wikidata.org/sparql"
 wikipedia_dumpdir = "../../WikipediaDump"
 gwikimatch_dir = "GWikiMatch"
+article_cache_dir = os.path.join("cache", "articles")
+
+
+def positive_integer(value):
+    """
+    Type of the command line arguments that must be at least 1
+    :param value: the text of the argument
+    :return: the number
+    """
+
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+
+    return number
 
 
 def read_arguments():
     """
     Read arguments from the command line
-    :return: (subject, outputdirectory, language)
+    :return: (subject, outputdirectory, language, workers, redirects, similarity, max_document_frequency, permutations, bands, spill_texts, treshold, top_k, incremental, resume, keep_intermediates, streaming, article_cache_size)
     """
 
     parser = argparse.ArgumentParser(description='Read articles from Wikipedia based on the WikiData knowledge graph.')
     parser.add_argument('-s', '--subjects', help='Main wikidata subjects, a comma seperated list of WikiData ids (for example "wd:Q7397")', required=True)
     parser.add_argument('-l', '--language', help='Language code, for example "nl", "en" or "simple"', required=True, default="en")
     parser.add_argument('-o', '--output', help='Output directory', required=True)
+    parser.add_argument('-w', '--workers', help='Number of processes used for decompressing the dump, splitting the articles and calculating the links', required=False, type=int, default=1)
+    parser.add_argument('-r', '--redirects', help='Resolve titles that are redirects to the article they point to', action='store_true')
+    parser.add_argument('--similarity', help='Method to calculate the jaccard indexes', required=False, choices=Links.similarity_methods, default="sparse")
+    parser.add_argument('--max-df', help='Link targets in more documents are not used to find candidates (only for "inverted")', required=False, type=int, default=None)
+    parser.add_argument('--permutations', help='Number of hash functions (only for "minhash")', required=False, type=int, default=128)
+    parser.add_argument('--bands', help='Number of bands for locality sensitive hashing (only for "minhash")', required=False, type=int, default=32)
+    parser.add_argument('--spill-texts', help='Keep the texts of the sections in a temporary file instead of in memory during step 3', action='store_true')
+    parser.add_argument('-t', '--threshold', help='Minimal jaccard index of a link', required=False, type=float, default=0.4)
+    parser.add_argument('--top-k', help='Maximum number of links per article and per section, the links with the highest index are kept', required=False, type=positive_integer, default=None)
+    parser.add_argument('--incremental', help='Only calculate the links of new and changed articles, using the state of the previous run in the output directory', action='store_true')
+    parser.add_argument('--resume', help='Skip the articles that are already done according to the manifest in the output directory', action='store_true')
+    parser.add_argument('--keep-intermediates', help='Do not remove the step1 and step2 directories at the end', action='store_true')
+    parser.add_argument('--streaming', help='Pass the articles from the dump directly to step 3, without the step1 and step2 directories', action='store_true')
+    parser.add_argument('--article-cache', help='Maximum size in MB of the cache with parsed articles, 0 for no cache', required=False, type=int, default=0)
     args = vars(parser.parse_args())
 
 
@@ -38,66 +71,111 @@ def read_arguments():
         exit( 3)
 
     output = args["output"]
-    return (subjects,output, args["language"].lower())
+    return (subjects,output, args["language"].lower(), args["workers"], args["redirects"], args["similarity"], args["max_df"], args["permutations"], args["bands"], args["spill_texts"], args["threshold"], args["top_k"], args["incremental"],
+            args["resume"], args["keep_intermediates"], args["streaming"], args["article_cache"])
 
 
-def save_article(wikidata, wikidata_id, name, output):
+def save_article(id, xml, output):
     """
-    Save the row (id, url). Retrieve the text and the connections
-    :param row:
+    Save the xml of the article
+    :param id: the wikidata id, used as the filename
+    :param xml: the xml of the article
     :param output: output directory
     :return:
     """
 
-    lemma = wikidata.url_to_name(name)
-    id = wikidata_id.replace("wd:", "")
-    if not lemma is None:
-        xml = wikidata.read_wikipedia_article(id, lemma)
-        filename = os.path.join(output, id + ".xml")
-        if not xml is None:
-            functions.write_file(filename, str(xml))
+    filename = os.path.join(output, id + ".xml")
+    if not xml is None:
+        functions.write_file(filename, str(xml))
 
 
-def step1(subjects, language, output):
+def step1(subjects, language, output, workers, redirects, manifest=None):
     """
     Perform step1, extract data from Wikidata into xml files
     :param subjects:
     :param language:
     :param output:
-    :return:
+    :param workers: number of processes for decompressing the dump
+    :param redirects: if True redirects are resolved
+    :param manifest: if not None, the articles that are done are skipped and the new articles are recorded
+    :return: the name of the dump file
     """
     wikidata = Wikidata(wikidata_endpoint=wikidata_enpoint, subjects=subjects, dump_dir=wikipedia_dumpdir,
-                        language=language, debug=False)
+                        language=language, debug=False, workers=workers, resolve_redirects=redirects)
     rows = wikidata.read_all_items()
     if output == "" or output is None:
         print(len(rows))
     else:
         functions.create_directory_if_not_exists(output)
-        for row in rows:
-            save_article(wikidata, wikidata_id=row[0], name=row[1], output=output)
+        articles = [(row[0].replace("wd:", ""), wikidata.url_to_name(row[1])) for row in rows]
+        if not manifest is None:
+            # The input is the article in this dump
+            dump = os.path.basename(wikidata.dump_file)
+            input_hashes = {id: Manifest.hash(f"{dump}|{name}") for (id, name) in articles}
+            articles = [(id, name) for (id, name) in articles
+                                   if not manifest.is_done("step1", id, input_hashes[id], os.path.join(output, id + ".xml"))]
+
+        for (id, lemma, xml) in wikidata.read_wikipedia_articles(articles):
+            save_article(id, xml, output=output)
+            if not manifest is None:
+                manifest.done("step1", id, input_hashes[id], os.path.join(output, id + ".xml"))
+
+        print( wikidata.block_cache.statistics())
 
+    return wikidata.dump_file
 
-def step2( input_dir, output_dir):
+
+def create_article_cache(size, dump_file):
+    """
+    Create the cache with parsed articles
+    :param size: maximum size in MB, 0 for no cache
+    :param dump_file: the dump the articles come from
+    :return: None or the ArticleCache
+    """
+
+    return ArticleCache(article_cache_dir, size * 1024 * 1024, dump_file) if size > 0 else None
+
+
+def step2( input_dir, output_dir, manifest=None, workers=1, cache=None, language=None):
     """
     Perform step2, splitting articles into sections, and returns statistics in a tuple
     :param input_dir:
     :param output_dir:
+    :param manifest: if not None, the articles that are done are skipped and the new articles are recorded
+    :param workers: number of processes that split the articles
+    :param cache: None or the ArticleCache of the dump
+    :param language: language code of the articles
     :return: (articles, with_sections, with_sections, without_sections, total_sections)
     """
     files = functions.read_all_files_from_directory(input_dir, "xml")
     functions.create_directory_if_not_exists(output_dir)
 
+    # The number of sections per id, from the manifest or from splitting the file
+    sections_of_id = {}
+    todo = []
+    for file in files:
+        id = os.path.splitext(os.path.basename(file))[0]
+        if not manifest is None and manifest.is_done("step2", id, Manifest.hash_file(file), os.path.join(output_dir, f"{id}.xml")):
+            sections_of_id[id] = manifest.entry("step2", id)["sections"]
+        else:
+            todo.append(file)
+
+    chunks = functions.create_chunks_of_list(todo, Sections.articles_per_task)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(Sections.create_sections_of_files, chunks, repeat(output_dir), repeat(cache), repeat(language))
+            save_step2_results(chunks, results, output_dir, sections_of_id, manifest)
+    else:
+        results = map(Sections.create_sections_of_files, chunks, repeat(output_dir), repeat(cache), repeat(language))
+        save_step2_results(chunks, results, output_dir, sections_of_id, manifest)
+
     total_sections = 0
     total_articles_with_sections = 0
     total_articles_without_sections = 0
 
     counter = 1
     for file in files:
-        contents = functions.read_file(file)
-        id = os.path.splitext(os.path.basename(file))[0]
-
-        sections = Sections( contents)
-        number_of_sections = sections.create_sections(with_keys=True, id=id, output_dir=output_dir, links=[])
+        number_of_sections = sections_of_id[os.path.splitext(os.path.basename(file))[0]]
         total_sections += number_of_sections
         if( number_of_sections > 0):
             total_articles_with_sections += 1
@@ -109,66 +187,188 @@ def step2( input_dir, output_dir):
     return( counter - 1, total_articles_with_sections, total_articles_without_sections, total_sections)
 
 
-def save_distance(links, output_dir, treshold, start_index, end_index):
-    links.save_distance(output_dir, treshold, start_index, end_index)
+def save_step2_results(chunks, results, output_dir, sections_of_id, manifest):
+    """
+    Collect the number of sections of the split files and record them in the manifest
+    :param chunks: the lists of files
+    :param results: the lists with the number of sections, in the same order as the chunks
+    :param output_dir:
+    :param sections_of_id: dictionary id -> number of sections that is filled
+    :param manifest: None or the manifest
+    :return:
+    """
+
+    for (chunk, numbers) in zip(chunks, results):
+        for (file, number_of_sections) in zip(chunk, numbers):
+            id = os.path.splitext(os.path.basename(file))[0]
+            sections_of_id[id] = number_of_sections
+            if not manifest is None:
+                manifest.done("step2", id, Manifest.hash_file(file), os.path.join(output_dir, f"{id}.xml"), sections=number_of_sections)
 
 
-def step3( input_dir, output_dir, treshold):
+def stream_documents(subjects, language, workers, redirects, statistics, article_cache_size=0):
+    """
+    Step 1 and step 2 without files: the articles go from the dump directly into Sections and the documents are
+    returned for Links (step 3). The next article is only read from the dump when Links asks for it.
+    :param subjects:
+    :param language:
+    :param workers: number of processes for decompressing the dump
+    :param redirects: if True redirects are resolved
+    :param statistics: dictionary that is filled with the ids and the numbers that step2 returns
+    :param article_cache_size: maximum size in MB of the cache with parsed articles, 0 for no cache
+    :return: generator of (doc element, filename)
+    """
+    wikidata = Wikidata(wikidata_endpoint=wikidata_enpoint, subjects=subjects, dump_dir=wikipedia_dumpdir,
+                        language=language, debug=False, workers=workers, resolve_redirects=redirects)
+    cache = create_article_cache(article_cache_size, wikidata.dump_file)
+    articles = [(row[0].replace("wd:", ""), wikidata.url_to_name(row[1])) for row in wikidata.read_all_items()]
+
+    statistics.update( {"ids": [], "articles": 0, "with_sections": 0, "without_sections": 0, "sections": 0})
+    seen = set()  # An id is one file in step 1
+    for (id, lemma, xml) in wikidata.read_wikipedia_articles(articles):
+        if not xml is None and not id in seen:
+            seen.add(id)
+            (doc, number_of_sections) = Sections( str(xml), cache, language).create_sections_element(with_keys=True, id=id, links=[])
+
+            statistics["ids"].append(id)
+            statistics["articles"] += 1
+            statistics["sections"] += number_of_sections
+            if( number_of_sections > 0):
+                statistics["with_sections"] += 1
+            else:
+                statistics["without_sections"] += 1
+
+            yield (doc, f"{id}.xml")
+
+    print( wikidata.block_cache.statistics())
+
+
+def write_statistics(output, articles, with_sections, without_sections, total_sections):
+    """
+    Write the statistics of step 2 in stats.txt
+    :param output: the output directory
+    :param articles:
+    :param with_sections:
+    :param without_sections:
+    :param total_sections:
+    :return:
+    """
+
+    stats_file = os.path.join(output, "stats.txt")
+    functions.write_file(stats_file, f"Number of articles               : {articles}" +
+                                     f"Number articles with sections    : {with_sections}" +
+                                     f"Total number of sections         : {total_sections}" +
+                                     f"Number articles without sections : {without_sections}" +
+                                     f"Percentage articles with sections: {(articles / with_sections):0.2f}"
+                         );
+
+
+def step3( input_dir, output_dir, treshold, similarity="sparse", max_document_frequency=None, permutations=128, bands=32, spill_texts=False, workers=1, top_k=None, incremental=False, manifest=None, documents=None):
     """
     Creates a tsv file with links from one ID to another
-    :param input_dir:
+    :param input_dir: the directory with the files of step 2, None if only documents are used
     :param linkfile:
+    :param similarity: method to calculate the jaccard indexes, see Links
+    :param max_document_frequency: see Links
+    :param permutations: see Links
+    :param bands: see Links
+    :param spill_texts: if True the texts are kept in a temporary file in the output directory
+    :param workers: number of processes that save the distances
+    :param top_k: if not None, the maximum number of links per article and per section
+    :param incremental: if True only new and changed articles are calculated, see Links.save_distance_incremental
+    :param manifest: if not None, nothing is done if the input and the output files did not change since the last run
+    :param documents: if not None, iterable of (doc element, filename) of step 2 that are used next to the files, see stream_documents
     :return:
     """
 
     functions.create_directory_if_not_exists(output_dir)
-    files = functions.read_all_files_from_directory(input_dir, "xml")
+    files = [] if input_dir is None else functions.read_all_files_from_directory(input_dir, "xml")
 
+    if not manifest is None:
+        # The links of every article depend on all input files
+        parameters = (treshold, similarity, max_document_frequency, permutations, bands, top_k)
+        input_hash = Manifest.hash( str(parameters) + "".join( sorted( f"{os.path.basename( file)}:{Manifest.hash_file( file)}" for file in files)))
+        outputs = {os.path.basename( file).replace(".xml", ""): os.path.join( output_dir, os.path.basename( file)) for file in files}
+        if all( manifest.is_done("step3", id, input_hash, output_file) for (id, output_file) in outputs.items()):
+            print("The links are up to date")
+            return
 
-    links = Links( files)
+
+    links = Links( files, similarity=similarity, max_document_frequency=max_document_frequency, permutations=permutations, bands=bands,
+                   spill_dir=output_dir if spill_texts else None,
+                   state_file=os.path.join( output_dir, Links.state_filename) if incremental else None, documents=documents)
     name_id = links.read_name_id()
     links.read_links( name_id)
-    links.save_distance(output_dir, treshold, 0, len(files))
+    if similarity == "minhash":
+        links.report_recall( treshold)
+    if incremental:
+        links.save_distance_incremental(output_dir, treshold, workers, top_k)
+    else:
+        links.save_distance_parallel(output_dir, treshold, workers, top_k)
+    links.close()
+
+    if not manifest is None:
+        for (id, output_file) in outputs.items():
+            manifest.done("step3", id, input_hash, output_file)
 
 
 
 
 # Main part of the script
 if __name__ == '__main__':
-    (subjects, output, language) = read_arguments()
+    (subjects, output, language, workers, redirects, similarity, max_document_frequency, permutations, bands, spill_texts, treshold, top_k, incremental, resume, keep_intermediates, streaming, article_cache_size) = read_arguments()
 
     wikimatch = GWikiMatch(dir=gwikimatch_dir, wikidata_endpoint=wikidata_enpoint, debug=False)
 
     step1_dir = os.path.join(output, "step1")
     step2_dir = os.path.join(output, "step2")
+    functions.create_directory_if_not_exists(output)
 
-    # Read all data from wikipedia
-    step1(subjects, language, step1_dir)
+    if streaming:
+        # Read the articles, split them into sections and create the links without intermediate files
+        statistics = {}
+        step3(input_dir=None, output_dir=output, treshold=treshold, similarity=similarity, max_document_frequency=max_document_frequency,
+              permutations=permutations, bands=bands, spill_texts=spill_texts, workers=workers, top_k=top_k, incremental=incremental,
+              documents=stream_documents(subjects, language, workers, redirects, statistics, article_cache_size))
 
-    # Split the articles into sections
-    (articles, with_sections, without_sections, total_sections) = step2( step1_dir, step2_dir)
+        write_statistics(output, statistics["articles"], statistics["with_sections"], statistics["without_sections"], statistics["sections"])
+        ids = statistics["ids"]
 
-    # Write the statistics
-    stats_file = os.path.join(output, "stats.txt")
-    functions.write_file(stats_file, f"Number of articles               : {articles}" +
-                                     f"Number articles with sections    : {with_sections}" +
-                                     f"Total number of sections         : {total_sections}" +
-                                     f"Number articles without sections : {without_sections}" +
-                                     f"Percentage articles with sections: {(articles / with_sections):0.2f}"
-                         );
+    else:
+        manifest = Manifest(output, resume=resume)
+
+        # Read all data from wikipedia
+        dump_file = step1(subjects, language, step1_dir, workers, redirects, manifest)
+        manifest.save()
+
+        # Split the articles into sections
+        cache = create_article_cache(article_cache_size, dump_file)
+        (articles, with_sections, without_sections, total_sections) = step2( step1_dir, step2_dir, manifest, workers, cache, language)
+        manifest.save()
 
+        # Write the statistics
+        write_statistics(output, articles, with_sections, without_sections, total_sections)
 
-    # Create a link file based on the input
-    step3(input_dir=step2_dir, output_dir=output, treshold=0.4)
+
+        # Create a link file based on the input
+        step3(input_dir=step2_dir, output_dir=output, treshold=treshold, similarity=similarity, max_document_frequency=max_document_frequency,
+              permutations=permutations, bands=bands, spill_texts=spill_texts, workers=workers, top_k=top_k, incremental=incremental, manifest=manifest)
+        manifest.save()
+
+        ids = [ os.path.basename( file).replace(".xml", "") for file in functions.read_all_files_from_directory( os.path.join(output, "step1"), "xml")]
+
+        # Clean up
+        if not keep_intermediates:
+            functions.remove_redirectory_recursivly( step1_dir)
+            functions.remove_redirectory_recursivly( step2_dir)
+            manifest.remove_step("step1")
+            manifest.remove_step("step2")
+            manifest.save()
 
 
     # Create a tsv file in the output with the links form gwikimatch
-    ids = [ os.path.basename( file).replace(".xml", "") for file in functions.read_all_files_from_directory( os.path.join(output, "step1"), "xml")]
     wikimatch.append_to_filtered_file(os.path.join(output, "gwikimatch.tsv"), set(ids))
 
     functions.write_corpus_info(output, f"WikiData " + language.upper(), language)
 
-    # Clean up
-    functions.remove_redirectory_recursivly( step1_dir)
-    functions.remove_redirectory_recursivly( step2_dir)
-
+    print( WDSparql.cache_statistics())
@@ -2,20 +2,38 @@
 
 from SPARQLWrapper import SPARQLWrapper, JSON
 import requests
+from requests.adapters import HTTPAdapter
+import asyncio
 import os
 import json
+import threading
 import time
 import functions
+from RateLimiter import RateLimiter
+from SparqlCache import SparqlCache
 
 class WDSparql:
     """
     Sparql queries for WikiData. Takes care of the limits:
         - One client (user agent + IP) is allowed 60 seconds of processing time each 60 seconds
         - One client is allowed 30 error queries per minute
-    Therefore results are cached in a file
+    Therefore results are cached in a SparqlCache in the cache directory. The queries to an endpoint share one session with keep-alive
+    connections and one RateLimiter, which only waits when one of the limits requires it
     """
 
-    delayBetweenCallsInms = 2.1
+    max_attempts = 5        # Number of times a query is tried when the server is busy or not reachable
+    timeout = 120           # Seconds to wait for the response of a query
+    max_connections = 8     # Number of connections that are kept open per endpoint
+    retry_status_codes = {429, 502, 503, 504}  # The query can be tried again after these responses, 500 is a query that takes too long
+    max_concurrent_queries = 5  # The query service allows 5 concurrent queries per client
+
+    cache_filename = "sparql.sqlite"  # Name of the cache in the cache directory
+    cache_ttl = None        # Number of seconds a cached result is used, None for always
+    cache_max_bytes = None  # Maximum size of the compressed results in the cache, None for no limit
+
+    clients = {}            # Endpoint url -> (session, rate limiter), shared by all instances
+    caches = {}             # Cache file -> SparqlCache, shared by all instances
+    clients_lock = threading.Lock()
 
     def __init__(self, cachedir, endpoint_url, debug=False):
         if not os.path.isdir( cachedir): # Create directory if not exists
@@ -24,33 +42,148 @@ class WDSparql:
         self.cache_dir = cachedir
         self.endpoint_url = endpoint_url
         self.debug = debug
+        (self.session, self.rate_limiter) = WDSparql.client( endpoint_url)
+        self.cache = WDSparql.open_cache( os.path.join( cachedir, WDSparql.cache_filename))
+
+
+
+    @staticmethod
+    def client(endpoint_url):
+        """
+        Returns the session and the rate limiter of the endpoint, they are created at the first use
+        :param endpoint_url:
+        :return: (session, rate limiter)
+        """
+
+        with WDSparql.clients_lock:
+            if not endpoint_url in WDSparql.clients:
+                session = requests.Session()
+                session.headers.update( {
+                    "User-Agent": "Other",
+                    "content-type": "application/json"
+                })
+                adapter = HTTPAdapter( pool_connections=1, pool_maxsize=WDSparql.max_connections)
+                session.mount( "http://", adapter)
+                session.mount( "https://", adapter)
+                WDSparql.clients[endpoint_url] = (session, RateLimiter())
+
+            return WDSparql.clients[endpoint_url]
+
+
+
+    @staticmethod
+    def open_cache(filename):
+        """
+        Returns the cache in the file, it is opened at the first use
+        :param filename:
+        :return: SparqlCache
+        """
+
+        with WDSparql.clients_lock:
+            if not filename in WDSparql.caches:
+                WDSparql.caches[filename] = SparqlCache( filename, ttl=WDSparql.cache_ttl, max_bytes=WDSparql.cache_max_bytes)
+
+            return WDSparql.caches[filename]
+
+
+
+    @staticmethod
+    def cache_statistics():
+        """
+        Returns the statistics of the caches that are used
+        :return: text with a line per cache
+        """
+
+        with WDSparql.clients_lock:
+            return "\n".join( cache.statistics() for cache in WDSparql.caches.values())
 
 
 
     def query(self, sparql, name):
         """
-        Call the query, if a file exists with the given name the cached data is returned
+        Call the query, if the cache has a result with the given name the cached data is returned
         :param sparql: the query
         :param name: chache name
         :return: object with the data
         """
 
-        short = functions.hash_string(name)
-        cache_file = os.path.join( self.cache_dir, f"{short}.json")
-        if not self.debug and os.path.isfile( cache_file):
-            results = functions.read_file( cache_file)
-        else:
+        key = functions.hash_string(name)
+        results = None if self.debug else self.cache.get( key)
+        if results is None:
             results = self.__perform_query( sparql)
-
-            # Add the sparql query
-            as_json = json.loads(results)
-            as_json["sparq"] = sparql
-            functions.write_file( cache_file, json.dumps(as_json))
+            bindings = json.loads(results)["results"]["bindings"]  # Only complete results are cached
+            self.cache.put( key, sparql, results)
+            return bindings
 
         return json.loads(results)["results"]["bindings"]
 
 
 
+    def query_chunks(self, chunks, create_query, prefix, max_concurrent=None):
+        """
+        Performs a query for every chunk of items, several queries at the same time. See query_chunks_async
+        :param chunks: list with lists of items
+        :param create_query: function that returns the query for a list of items
+        :param prefix: the cache name of a query is the prefix followed by the query
+        :param max_concurrent: maximum number of queries at the same time, None for max_concurrent_queries
+        :return: list with the rows of all queries, in the order of the chunks
+        """
+
+        return asyncio.run( self.query_chunks_async( chunks, create_query, prefix, max_concurrent))
+
+
+
+    async def query_chunks_async(self, chunks, create_query, prefix, max_concurrent=None):
+        """
+        Performs a query for every chunk of items, at most max_concurrent at the same time, within the limits of the
+        rate limiter. The result of every query is cached when it is done. If the query of a chunk takes too long
+        (see is_too_large), the chunk is split in two halves that are queried separately. Other errors, and a chunk
+        of one item that is too large, raise the error
+        :param chunks: list with lists of items
+        :param create_query: function that returns the query for a list of items
+        :param prefix: the cache name of a query is the prefix followed by the query
+        :param max_concurrent: maximum number of queries at the same time, None for max_concurrent_queries
+        :return: list with the rows of all queries, in the order of the chunks
+        """
+
+        semaphore = asyncio.Semaphore( WDSparql.max_concurrent_queries if max_concurrent is None else max_concurrent)
+
+        async def query_chunk(chunk):
+            query = create_query( chunk)
+            try:
+                async with semaphore:
+                    return await asyncio.to_thread( self.query, query, prefix + query)
+            except (requests.HTTPError, ValueError, KeyError) as error:
+                if not WDSparql.is_too_large( error) or len(chunk) <= 1:
+                    raise
+
+            half = len(chunk) // 2
+            (first, second) = await asyncio.gather( query_chunk( chunk[:half]), query_chunk( chunk[half:]))
+            return first + second
+
+        results = await asyncio.gather( *[query_chunk( chunk) for chunk in chunks])
+
+        return [row for rows in results for row in rows]
+
+
+
+    @staticmethod
+    def is_too_large(error):
+        """
+        Returns True if the error of a query means that the query takes too long, so a smaller query can succeed:
+        the query service returns 500 or an incomplete result. The server being busy or not reachable is not
+        solved by more queries
+        :param error: the exception of WDSparql.query
+        :return:
+        """
+
+        if isinstance( error, requests.HTTPError):
+            return not error.response is None and error.response.status_code == 500
+
+        return not isinstance( error, requests.RequestException)  # Invalid json or no results in it
+
+
+
     def __perform_query(self, sparql):
         """
         Perform the query and return the resulting json
@@ -58,21 +191,28 @@ class WDSparql:
         :return: JSON string
         """
 
-        headers = {
-            "User-Agent": "Other",
-            "content-type": "application/json"
-        }
-
         parameters = {
             "format": "json",
             "query": sparql
         }
 
-
-        r = requests.get(url=self.endpoint_url, params=parameters, headers = headers)
-        time.sleep(WDSparql.delayBetweenCallsInms)  # Make sure we don't cross the limits
-
-        return r.text
+        for attempt in range(1, WDSparql.max_attempts + 1):
+            self.rate_limiter.wait()
+            start = time.monotonic()
+            try:
+                r = self.session.get( url=self.endpoint_url, params=parameters, timeout=WDSparql.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                self.rate_limiter.done( time.monotonic() - start, error=True)
+                if attempt == WDSparql.max_attempts:
+                    raise
+                continue
+
+            error = r.status_code >= 400
+            self.rate_limiter.done( time.monotonic() - start, error=error, retry_after=r.headers.get("Retry-After"))
+            if not error:
+                return r.text
+            if not r.status_code in WDSparql.retry_status_codes or attempt == WDSparql.max_attempts:
+                r.raise_for_status()
 
 
 
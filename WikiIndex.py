@@ -0,0 +1,296 @@
+# Class to build and read a compact index of a Wikipedia multistream dump
+import array
+import bz2
+import heapq
+import html
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+class WikiIndex:
+    """
+    Compact on-disk version of the *-multistream-index.txt.bz2 file. The file contains the sorted titles
+    (utf-8, concatenated) and parallel integer arrays:
+        - title_offsets: position of every title in the titles blob (one extra at the end)
+        - title_blocks:  number of the multistream block that contains the article
+        - page_ids:      the Wikipedia page id of the article
+        - block_starts:  byte position of every block in the dump, followed by 0 for the end of the last block
+    """
+
+    magic = b"WIKIIDX2"              # Version 2: the titles are unescaped with html.unescape
+    header = struct.Struct("<8sqq")  # magic, number of titles, number of blocks
+    titles_per_chunk = 1000000       # Number of titles that are sorted in memory while building the index
+
+
+    def __init__(self, index_file):
+        """
+        Open the compact index belonging to the bz2 index file, it is created if it does not exist
+        :param index_file: the *-multistream-index.txt.bz2 file
+        """
+
+        self.filename = index_file.replace("txt.bz2", "idx")
+        if not os.path.isfile( self.filename):
+            print("One moment please, building index...")
+            WikiIndex.build( index_file, self.filename)
+
+        self.__open()
+
+
+    def __open(self):
+        """
+        Memory map the index file, the operating system only reads the pages that are used by a lookup
+        :return:
+        """
+
+        with open( self.filename, "rb") as file:
+            self.map = mmap.mmap( file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, self.count, self.block_count) = WikiIndex.header.unpack_from( self.map, 0)
+        if magic != WikiIndex.magic:
+            self.map.close()
+            raise ValueError(f"'{self.filename}' is not a valid index file, remove it to rebuild the index")
+
+        self.view = memoryview( self.map)
+        position = WikiIndex.header.size
+        (self.title_offsets, position) = self.__array_view( position, self.count + 1)
+        (self.title_blocks, position) = self.__array_view( position, self.count)
+        (self.page_ids, position) = self.__array_view( position, self.count)
+        (self.block_starts, position) = self.__array_view( position, self.block_count + 1)
+        self.titles_start = position
+
+
+    def __array_view(self, position, length):
+        """
+        Returns a view on an array of 64 bits integers in the memory map, without copying
+        :param position: start position in the file
+        :param length: number of integers
+        :return: (view, position after the array)
+        """
+
+        end = position + length * 8
+        return (self.view[position:end].cast("q"), end)
+
+
+    def close(self):
+        """
+        Release the memory map
+        :return:
+        """
+
+        for view in [self.title_offsets, self.title_blocks, self.page_ids, self.block_starts, self.view]:
+            view.release()
+        self.map.close()
+
+
+    def __title(self, row):
+        """
+        Returns the title in the given row as utf-8 bytes
+        :param row:
+        :return:
+        """
+        return self.map[self.titles_start + self.title_offsets[row]:self.titles_start + self.title_offsets[row + 1]]
+
+
+    def find(self, title):
+        """
+        Binary search for the title
+        :param title:
+        :return: the row of the title or -1 if it is not found
+        """
+
+        key = title.encode("utf-8")
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.__title( middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self.count and self.__title( low) == key:
+            return low
+        else:
+            return -1
+
+
+    def location(self, row):
+        """
+        Returns the location of the article in the given row
+        :param row:
+        :return: (start, end, articleid)
+        """
+
+        block = self.title_blocks[row]
+        return (self.block_starts[block], self.block_starts[block + 1], self.page_ids[row])
+
+
+    def __len__(self):
+        return self.count
+
+
+    def __contains__(self, title):
+        return self.find( title) >= 0
+
+
+    def __getitem__(self, title):
+        """
+        Returns the location of the article with the given title
+        :param title:
+        :return: (start, end, articleid)
+        """
+
+        row = self.find( title)
+        if row < 0:
+            raise KeyError( title)
+
+        return self.location( row)
+
+
+    def keys(self):
+        """
+        Generator for all titles in the index, in sorted order
+        :return:
+        """
+
+        for row in range(0, self.count):
+            yield self.__title( row).decode("utf-8")
+
+
+    @staticmethod
+    def build(index_file, filename):
+        """
+        Create the compact index by streaming through the bz2 index file. Titles are sorted in chunks that are
+        written to temporary files and merged afterwards, so the memory use is limited to one chunk.
+        :param index_file: the *-multistream-index.txt.bz2 file
+        :param filename: the compact index to be created
+        :return:
+        """
+
+        with tempfile.TemporaryDirectory( dir=os.path.dirname( os.path.abspath( filename))) as temp_dir:
+            (chunk_files, block_starts) = WikiIndex.__write_sorted_chunks( index_file, temp_dir)
+            block_starts.append( 0)  # The last block runs until the end of the file
+
+            parts = [os.path.join( temp_dir, name) for name in ["offsets", "blocks", "ids", "titles"]]
+            count = WikiIndex.__merge_chunks( chunk_files, parts)
+
+            with open( filename + ".tmp", "wb") as output:
+                output.write( WikiIndex.header.pack( WikiIndex.magic, count, len(block_starts) - 1))
+                for part in parts[:3]:
+                    with open( part, "rb") as file:
+                        shutil.copyfileobj( file, output)
+                block_starts.tofile( output)
+                with open( parts[3], "rb") as file:
+                    shutil.copyfileobj( file, output)
+
+        os.replace( filename + ".tmp", filename)
+
+
+    @staticmethod
+    def __write_sorted_chunks(index_file, temp_dir):
+        """
+        Read the lines of the index file (offset:articleid:title) and write them in sorted chunks
+        :param index_file:
+        :param temp_dir: directory for the chunks
+        :return: (list of chunk files, array with the start of each block)
+        """
+
+        chunk_files = []
+        block_starts = array.array("q")
+        current = None
+        chunk = []
+
+        with bz2.open( index_file, "rt", encoding="utf-8") as lines:
+            for line in lines:
+                parts = line.rstrip("\n").split(":", 2)
+                if len(parts) == 3:  # Only valid lines
+                    if parts[0] != current:
+                        current = parts[0]
+                        block_starts.append( int(current))
+
+                    title = html.unescape( parts[2]).encode("utf-8")
+                    chunk.append( (title, len(block_starts) - 1, int(parts[1])))
+                    if len(chunk) >= WikiIndex.titles_per_chunk:
+                        chunk_files.append( WikiIndex.__write_chunk( chunk, temp_dir, len(chunk_files)))
+                        chunk = []
+
+        if len(chunk) > 0:
+            chunk_files.append( WikiIndex.__write_chunk( chunk, temp_dir, len(chunk_files)))
+
+        return (chunk_files, block_starts)
+
+
+    @staticmethod
+    def __write_chunk(chunk, temp_dir, number):
+        """
+        Sort the chunk on title (stable, so the first occurrence stays first) and write it to a file
+        :param chunk: list of (title, block, articleid)
+        :param temp_dir:
+        :param number: sequence number of the chunk
+        :return: name of the file
+        """
+
+        chunk.sort( key=lambda entry: entry[0])
+        filename = os.path.join( temp_dir, f"chunk{number:05}")
+        with open( filename, "wb") as file:
+            for (title, block, articleid) in chunk:
+                file.write( b"%s\t%d\t%d\n" % (title, block, articleid))
+
+        return filename
+
+
+    @staticmethod
+    def __read_chunk(filename):
+        """
+        Generator for the entries in a chunk file
+        :param filename:
+        :return: (title, block, articleid)
+        """
+
+        with open( filename, "rb") as file:
+            for line in file:
+                (title, block, articleid) = line.rstrip(b"\n").rsplit(b"\t", 2)
+                yield (title, int(block), int(articleid))
+
+
+    @staticmethod
+    def __merge_chunks(chunk_files, parts):
+        """
+        Merge the sorted chunks into the parts of the index, only the first occurrence of a title is used
+        :param chunk_files:
+        :param parts: filenames for the offsets, blocks, ids and titles
+        :return: the number of titles
+        """
+
+        files = [open( part, "wb") for part in parts]
+        offsets = array.array("q", [0])
+        blocks = array.array("q")
+        ids = array.array("q")
+        position = 0
+        count = 0
+        previous = None
+
+        merged = heapq.merge( *[WikiIndex.__read_chunk( chunk_file) for chunk_file in chunk_files], key=lambda entry: entry[0])
+        for (title, block, articleid) in merged:
+            if title != previous:
+                previous = title
+                position += len(title)
+                files[3].write( title)
+                offsets.append( position)
+                blocks.append( block)
+                ids.append( articleid)
+                count += 1
+
+                if len(ids) >= WikiIndex.titles_per_chunk:  # Flush the arrays
+                    for (values, file) in zip([offsets, blocks, ids], files):
+                        values.tofile( file)
+                        del values[:]
+
+        for (values, file) in zip([offsets, blocks, ids], files):
+            values.tofile( file)
+            file.close()
+        files[3].close()
+
+        return count
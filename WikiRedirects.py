@@ -0,0 +1,184 @@
+# Class to resolve redirects in a Wikipedia multistream dump
+import array
+import bz2
+import html
+import math
+import mmap
+import os
+import re
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from WikiIndex import WikiIndex
+
+class WikiRedirects:
+    """
+    Redirect table that is stored next to the compact index (see WikiIndex). It contains an array that is
+    parallel to the titles of the index, with the row of the final target of the redirect or -1 if the
+    title is not a redirect, so a redirect is resolved with a single lookup.
+    """
+
+    magic = b"WIKIRED2"             # Version 2: titles unescaped with html.unescape, chains resolved with the original targets
+    header = struct.Struct("<8sq")  # magic, number of titles
+    max_hops = 10                   # Maximum length of a chain of redirects
+    ranges_per_worker = 8           # Number of block ranges per worker while building the table
+
+    # The redirect element follows the title, ns and id of the page
+    redirect_re = re.compile(rb"<title>([^<]*)</title>\s*<ns>[^<]*</ns>\s*<id>[^<]*</id>\s*<redirect title=\"([^\"]*)\"")
+
+
+    def __init__(self, dump_file, index_file, wikindex, workers=1):
+        """
+        Open the redirect table, it is created with one pass over the dump if it does not exist
+        :param dump_file: the multistream dump
+        :param index_file: the *-multistream-index.txt.bz2 file
+        :param wikindex: the WikiIndex of the dump
+        :param workers: number of processes used while building the table
+        """
+
+        self.filename = WikiRedirects.filename_of( index_file)
+        if not os.path.isfile( self.filename):
+            WikiRedirects.build( dump_file, index_file, wikindex, self.filename, workers)
+
+        with open( self.filename, "rb") as file:
+            self.map = mmap.mmap( file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, count) = WikiRedirects.header.unpack_from( self.map, 0)
+        if magic != WikiRedirects.magic or count != len(wikindex):
+            self.map.close()
+            raise ValueError(f"'{self.filename}' does not belong to the index, remove it to rebuild the redirects")
+
+        self.view = memoryview( self.map)
+        self.targets = self.view[WikiRedirects.header.size:].cast("q")
+
+
+    @staticmethod
+    def filename_of(index_file):
+        """
+        Returns the name of the redirect table of the index
+        :param index_file: the *-multistream-index.txt.bz2 file
+        :return:
+        """
+
+        return index_file.replace("index.txt.bz2", "redirects.idx")
+
+
+    def resolve(self, row):
+        """
+        Returns the row of the article the title in the given row redirects to
+        :param row: row in the WikiIndex
+        :return: the row of the target or row itself if it is not a redirect
+        """
+
+        target = self.targets[row]
+        return row if target < 0 else target
+
+
+    def close(self):
+        """
+        Release the memory map
+        :return:
+        """
+
+        self.targets.release()
+        self.view.release()
+        self.map.close()
+
+
+    @staticmethod
+    def build(dump_file, index_file, wikindex, filename, workers):
+        """
+        Create the redirect table by reading all blocks of the dump
+        :param dump_file:
+        :param index_file:
+        :param wikindex:
+        :param filename: the redirect table to be created
+        :param workers: number of processes
+        :return:
+        """
+
+        starts = wikindex.block_starts
+        keys = [(starts[i], starts[i + 1]) for i in range(0, wikindex.block_count)]
+        size = max(1, math.ceil( len(keys) / (max(1, workers) * WikiRedirects.ranges_per_worker)))
+        ranges = [keys[i:i + size] for i in range(0, len(keys), size)]
+
+        targets = array.array("q", [-1]) * len(wikindex)
+        if workers > 1:
+            with ProcessPoolExecutor( max_workers=workers) as executor:
+                for pairs in executor.map( WikiRedirects.find_redirects, repeat( dump_file), repeat( index_file), ranges):
+                    WikiRedirects.__add_pairs( targets, pairs)
+        else:
+            for pairs in map( WikiRedirects.find_redirects, repeat( dump_file), repeat( index_file), ranges):
+                WikiRedirects.__add_pairs( targets, pairs)
+
+        WikiRedirects.__resolve_chains( targets)
+
+        with open( filename + ".tmp", "wb") as file:
+            file.write( WikiRedirects.header.pack( WikiRedirects.magic, len(targets)))
+            targets.tofile( file)
+        os.replace( filename + ".tmp", filename)
+
+
+    @staticmethod
+    def __add_pairs(targets, pairs):
+        """
+        Add the (source row, target row) pairs to the table
+        :param targets:
+        :param pairs:
+        :return:
+        """
+
+        for (source, target) in pairs:
+            targets[source] = target
+
+
+    @staticmethod
+    def __resolve_chains(targets):
+        """
+        Replace the targets of redirects to redirects by the final target, the chains are followed in a copy of
+        the table so every row is resolved with the original targets. Loops and chains of more than max_hops
+        redirects are removed
+        :param targets:
+        :return:
+        """
+
+        original = array.array("q", targets)
+        for row in range(0, len(original)):
+            target = original[row]
+            hops = 0
+            while target >= 0 and original[target] >= 0:
+                if hops == WikiRedirects.max_hops:  # A loop or a chain that is too long
+                    target = -1
+                    break
+                target = original[target]
+                hops += 1
+
+            targets[row] = target
+
+
+    @staticmethod
+    def find_redirects(dump_file, index_file, keys):
+        """
+        Read a range of consecutive blocks and find the redirects, runs in a worker process
+        :param dump_file:
+        :param index_file:
+        :param keys: list of (start, end) of consecutive blocks
+        :return: list of (source row, target row)
+        """
+
+        wikindex = WikiIndex( index_file)
+        pairs = []
+        with open( dump_file, 'rb') as file:
+            file.seek( keys[0][0])
+            for (start, end) in keys:
+                read = file.read( end - start if end > start else -1)
+                data = bz2.BZ2Decompressor().decompress( read)
+                for match in WikiRedirects.redirect_re.finditer( data):
+                    # The titles in the index are not escaped
+                    source = wikindex.find( html.unescape( match.group(1).decode("utf-8")))
+                    target = wikindex.find( html.unescape( match.group(2).decode("utf-8")))
+                    if source >= 0 and target >= 0 and source != target:
+                        pairs.append( (source, target))
+
+        wikindex.close()
+        return pairs
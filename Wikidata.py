@@ -2,21 +2,35 @@
 import random
 import re
 from WikiDataSparql import WDSparql
+from WikiIndex import WikiIndex
+from BlockCache import BlockCache
+from DumpBlock import DumpBlock
+from WikiRedirects import WikiRedirects
 import os
 import bz2
-import pickle
+import bisect
+import math
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import urllib.parse
 import functions
 from lxml import etree as ET
 
 class Wikidata:
     max_number_of_ids_for_wbgetentities = 50  # Maximum number of IDs to be queried at once
+    block_cache_bytes = 256 * 1024 * 1024     # Maximum size of the decompressed blocks in memory
+    scan_mode_fraction = 0.02                 # Fraction of all pages above which the dump is read sequentially
+    scan_ranges_per_worker = 4                # Number of block ranges per worker in scan mode
+    scan_read_bytes = 1024 * 1024             # Number of bytes that are read at once in scan mode
+    max_pending_per_worker = 4                # Number of tasks per worker that may be ahead of the consumer
 
 
-    def __init__(self, wikidata_endpoint, subjects, language, dump_dir, debug=False):
+    def __init__(self, wikidata_endpoint, subjects, language, dump_dir, debug=False, workers=1, resolve_redirects=False):
         """
         :param wikidata_endpoint: Wikidata SPARQL endpoint
         :param subjects: subject for the articles
+        :param workers: number of processes that decompress blocks in read_wikipedia_articles
+        :param resolve_redirects: if True the article a redirect points to is returned instead of the redirect
         """
         self.wikidata = WDSparql( "cache", wikidata_endpoint,debug=debug)
         self.subjects = subjects
@@ -25,6 +39,12 @@ class Wikidata:
         self.language = language
         (self.dump_file, self.index_file) =  self.__check_dump_dir( dump_dir, language)
         self.wikindex = self.__read_wiki_index( self.index_file)
+        self.block_cache = BlockCache( Wikidata.block_cache_bytes)
+        self.workers = workers
+        if resolve_redirects and not os.path.isfile( WikiRedirects.filename_of( self.index_file)):
+            print("One moment please, building redirects...")
+        self.redirects = WikiRedirects( self.dump_file, self.index_file, self.wikindex, workers) if resolve_redirects else None
+        self.redirects_resolved = 0
 
 
     def __check_dump_dir(self, dump_dir, language):
@@ -52,86 +72,13 @@ class Wikidata:
 
     def __read_wiki_index(self, index_file):
         """
-        Read the index file and create a dictionary with the words as keys and tuple (start, end)
-        It tries to load the data from a pickle file
+        Open the compact index of the dump, with the titles as keys and a tuple (start, end, articleid) as value.
+        The index is built from the index file the first time it is used
         :param index_file:
         :return:
         """
 
-        pickle_file = index_file.replace("txt.bz2", "pkl")
-        if os.path.isfile( pickle_file):
-            file = open(pickle_file, "rb")
-            words = pickle.load(file)
-            file.close()
-        else:
-            print("One moment please, building index...")
-            words = self.__make_wiki_index( index_file)
-            file = open(pickle_file, "wb")
-            words = pickle.dump(words, file)
-            file.close()
-
-        return words
-
-    def __make_wiki_index(self, index_file):
-        """
-        Read the index file and create a dictionary with the words as keys and tuple (articleid, start, end)
-        :param index_file:
-        :return:
-        """
-        lines = self.__read_all_lines_from_bz2( index_file)
-        lines_in_parts = [line.split(':', 2) for line in lines]
-        pos = self.__read_from_to( lines_in_parts)
-
-        words = {}
-        # Loop through all lines
-        for line in lines_in_parts:
-            if len( line) == 3:  ## Only valid lines
-                word = line[2].replace("&amp;", "&")
-                if not word in words:
-                    seekpos = line[0]
-                    articleid = int( line[1])
-                    words[word] = (pos[seekpos][0], pos[seekpos][1], articleid)
-
-        return words
-
-
-
-
-    def __read_from_to(self, lines):
-        """
-        returns a dictionary with a start position as a key and a tuple( start, end) as
-        value. The key is a string, the tuple contains two integers. It uses the
-        lines from the index as input and reads field 0 (the position)
-        :param lines:
-        :return:
-        """
-        current = ""
-        positions = []
-        for line in lines:
-            if len(line) == 3  and  line[0] != current:
-                current = line[0]
-                positions.append( current)
-        positions.append("0")
-
-        pos = {}
-        for i in range(0, len(positions) - 1):
-            pos[positions[i]] = ( int(positions[i]), int(positions[i+1]))
-
-        return pos
-
-
-    def __read_all_lines_from_bz2(self, filename):
-        """
-        Read all lines from a bz2 file
-        :param filename:
-        :return:
-        """
-
-        file = bz2.BZ2File(filename, "r")
-        text = file.read().decode("utf-8")
-        file.close()
-
-        return text.split("\n")
+        return WikiIndex( index_file)
 
 
     def read_all_items(self):
@@ -172,16 +119,246 @@ class Wikidata:
         :return:
         """
 
-        if not name in self.wikindex:
+        location = self.__locate( name)
+        if location is None:
             print(f"Unknown article '{name}'")
         else:
-            decomp = bz2.BZ2Decompressor()
+            (start, end, articleid) = location
+            block = self.__read_block( start, end)
+            return Wikidata.__get_article_from_xml(block, articleid, wikidata_id)
+
+
+    def __locate(self, name):
+        """
+        Find the location of the article in the dump, redirects are followed if they are resolved
+        :param name:
+        :return: (start, end, articleid) or None if the article is unknown
+        """
+
+        row = self.wikindex.find( name)
+        if row < 0:
+            return None
+
+        if not self.redirects is None:
+            target = self.redirects.resolve( row)
+            if target != row:
+                self.redirects_resolved += 1
+                row = target
+
+        return self.wikindex.location( row)
+
+
+    def read_wikipedia_articles(self, articles, scan_mode=None):
+        """
+        Read the xml for many wikipedia articles at once. The articles are grouped by the block of the dump
+        that contains them, and the blocks are read in the order of the file, each block only once.
+        :param articles: iterable of tuples (wikidata_id, name)
+        :param scan_mode: True to read the dump sequentially, False to seek to every block, None to choose
+                          based on the number of articles compared to the number of pages in the dump
+        :return: generator of tuples (wikidata_id, name, xml) in the order of the dump
+        """
+
+        blocks = {}
+        resolved = self.redirects_resolved
+        for (wikidata_id, name) in articles:
+            location = self.__locate( name)
+            if location is None:
+                print(f"Unknown article '{name}'")
+            else:
+                (start, end, articleid) = location
+                blocks.setdefault( (start, end), []).append( (articleid, wikidata_id, name))
+
+        if not self.redirects is None:
+            print(f"{self.redirects_resolved - resolved} titles resolved through a redirect")
+
+        if scan_mode is None:
+            requested = sum( len(requests) for requests in blocks.values())
+            scan_mode = requested > Wikidata.scan_mode_fraction * len(self.wikindex)
+
+        if scan_mode and len(blocks) > 0:
+            yield from self.__scan_dump( blocks)
+        elif self.workers > 1:
+            yield from self.__read_blocks_in_parallel( blocks)
+        else:
             with open( self.dump_file, 'rb') as file:
-                (start, end, articleid) = self.wikindex[name]
-                file.seek( start)  # Go to right position
-                read = file.read( end - start - 1 )
-                page_xml = decomp.decompress( read).decode()
-                return self.__get_article_from_xml(page_xml, articleid, wikidata_id)
+                for (start, end) in sorted( blocks.keys()):
+                    block = self.__read_block( start, end, file)
+                    for (articleid, wikidata_id, name) in blocks[(start, end)]:
+                        yield (wikidata_id, name, Wikidata.__get_article_from_xml(block, articleid, wikidata_id))
+
+
+    def __read_blocks_in_parallel(self, blocks):
+        """
+        Decompress the blocks and extract the articles in a pool of processes. The results are returned in the
+        same order as the serial version in read_wikipedia_articles.
+        :param blocks: dictionary with (start, end) as key and a list of (articleid, wikidata_id, name) as value
+        :return: generator of tuples (wikidata_id, name, xml)
+        """
+
+        keys = sorted( blocks.keys())
+        requests = [[(articleid, wikidata_id) for (articleid, wikidata_id, name) in blocks[key]] for key in keys]
+
+        with ProcessPoolExecutor( max_workers=self.workers) as executor:
+            results = functions.bounded_map( executor, self.workers * Wikidata.max_pending_per_worker, Wikidata.extract_articles, repeat( self.dump_file), keys, requests)
+            for (key, xmls) in zip( keys, results):
+                for ((articleid, wikidata_id, name), xml) in zip( blocks[key], xmls):
+                    yield (wikidata_id, name, xml)
+
+
+    @staticmethod
+    def extract_articles(dump_file, key, requests):
+        """
+        Read one block of the dump and extract the requested articles, runs in a worker process
+        :param dump_file:
+        :param key: (start, end) of the block
+        :param requests: list of (articleid, wikidata_id)
+        :return: list with the xml of the articles
+        """
+
+        with open( dump_file, 'rb') as file:
+            data = Wikidata.decompress_block( file, key[0], key[1])
+
+        block = DumpBlock( data)
+        return [Wikidata.__get_article_from_xml(block, articleid, wikidata_id) for (articleid, wikidata_id) in requests]
+
+
+    def __scan_dump(self, blocks):
+        """
+        Stream the dump from the first to the last block that contains a requested article: every bz2 stream is
+        decompressed and every page is matched with the requested page ids. The byte range is divided in ranges
+        at the starts of blocks, the ranges are streamed by the workers. The results are the same, and in the
+        same order, as those of the indexed lookup.
+        :param blocks: dictionary with (start, end) as key and a list of (articleid, wikidata_id, name) as value
+        :return: generator of tuples (wikidata_id, name, xml)
+        """
+
+        starts = self.wikindex.block_starts
+        keys = sorted( blocks.keys())
+        first = bisect.bisect_left( starts, keys[0][0], 0, self.wikindex.block_count)
+        last = bisect.bisect_left( starts, keys[-1][0], 0, self.wikindex.block_count)
+
+        number_of_ranges = max(1, self.workers * Wikidata.scan_ranges_per_worker)
+        size = max(1, math.ceil( (last - first + 1) / number_of_ranges))
+        ranges = []
+        for range_start in range(first, last + 1, size):
+            range_end = min(range_start + size, last + 1)
+            range_keys = [key for key in ((starts[i], starts[i + 1]) for i in range(range_start, range_end)) if key in blocks]
+            requests = [(articleid, wikidata_id) for key in range_keys for (articleid, wikidata_id, name) in blocks[key]]
+            ranges.append( (starts[range_start], starts[range_end], range_keys, requests))
+
+        arguments = [[r[0] for r in ranges], [r[1] for r in ranges], [r[3] for r in ranges]]
+        if self.workers > 1:
+            with ProcessPoolExecutor( max_workers=self.workers) as executor:
+                results = functions.bounded_map( executor, self.workers * Wikidata.max_pending_per_worker, Wikidata.scan_range, repeat( self.dump_file), *arguments)
+                yield from self.__scan_results( blocks, [r[2] for r in ranges], results)
+        else:
+            results = map( Wikidata.scan_range, repeat( self.dump_file), *arguments)
+            yield from self.__scan_results( blocks, [r[2] for r in ranges], results)
+
+
+    def __scan_results(self, blocks, range_keys, results):
+        """
+        Combine the results of scan_range with the requested articles, in the order of the indexed lookup
+        :param blocks: dictionary with (start, end) as key and a list of (articleid, wikidata_id, name) as value
+        :param range_keys: for every range the (start, end) of the blocks with requested articles
+        :param results: iterator of the results of scan_range
+        :return: generator of tuples (wikidata_id, name, xml)
+        """
+
+        for (keys, xmls) in zip( range_keys, results):
+            for key in keys:
+                for (articleid, wikidata_id, name) in blocks[key]:
+                    yield (wikidata_id, name, xmls.get( (articleid, wikidata_id), ""))  # Empty if not found
+
+
+    @staticmethod
+    def scan_range(dump_file, start, end, requests):
+        """
+        Read a range of the dump sequentially, decompress all bz2 streams in it and extract the pages with a
+        requested id. Runs in a worker process in scan mode.
+        :param dump_file:
+        :param start: position of the first block of the range
+        :param end: position after the range, 0 for the end of the file
+        :param requests: list of (articleid, wikidata_id)
+        :return: dictionary with (articleid, wikidata_id) as key and the xml of the article as value
+        """
+
+        wanted = {}
+        for (articleid, wikidata_id) in requests:
+            wanted.setdefault( articleid, []).append( wikidata_id)
+
+        results = {}
+        remaining = end - start if end > start else -1  # -1 is until the end of the file
+        pending = b""  # Decompressed data after the last complete page
+        decomp = bz2.BZ2Decompressor()
+        with open( dump_file, 'rb') as file:
+            file.seek( start)
+            while remaining != 0:
+                read = file.read( Wikidata.scan_read_bytes if remaining < 0 else min( Wikidata.scan_read_bytes, remaining))
+                if len(read) == 0:
+                    break
+                if remaining > 0:
+                    remaining -= len(read)
+
+                parts = [pending]
+                while len(read) > 0:
+                    parts.append( decomp.decompress( read))
+                    if decomp.eof:  # The next block is a new bz2 stream
+                        read = decomp.unused_data
+                        decomp = bz2.BZ2Decompressor()
+                    else:
+                        read = b""
+
+                pending = b"".join( parts)
+                block = DumpBlock( pending)
+                for (articleid, page_xml) in block.complete_pages():
+                    if articleid in wanted:
+                        page = ET.fromstring( page_xml)
+                        for wikidata_id in wanted[articleid]:
+                            results[(articleid, wikidata_id)] = Wikidata.__article_xml_to_text( page, wikidata_id)
+                pending = pending[block.position:]
+
+        return results
+
+
+    def __read_block(self, start, end, file=None):
+        """
+        Read and decompress the block of the dump that starts at start, recently used blocks come from the cache
+        :param start:
+        :param end:
+        :param file: the opened dump file, if None the file is opened
+        :return: DumpBlock
+        """
+
+        block = self.block_cache.get( start)
+        if block is None:
+            if file is None:
+                with open( self.dump_file, 'rb') as file:
+                    data = Wikidata.decompress_block( file, start, end)
+            else:
+                data = Wikidata.decompress_block( file, start, end)
+
+            block = DumpBlock( data)
+            self.block_cache.put( start, block, len(data))
+
+        return block
+
+
+    @staticmethod
+    def decompress_block(file, start, end):
+        """
+        Read and decompress one block (bz2 stream) of the multistream dump
+        :param file: the opened dump file
+        :param start:
+        :param end:
+        :return: the decompressed data
+        """
+
+        decomp = bz2.BZ2Decompressor()
+        file.seek( start)  # Go to right position
+        read = file.read( end - start - 1 if end > start else -1)  # The last block runs until the end
+
+        return decomp.decompress( read)
 
 
     def url_to_name(self, url):
@@ -200,39 +377,56 @@ class Wikidata:
         return name
 
 
-    def __get_article_from_xml(self, xml, articleid, wikidata_id):
+    @staticmethod
+    def __get_article_from_xml(block, articleid, wikidata_id):
         """
-        Read the article from the page xml
-        :param xml:
+        Read the article from the block, only the xml of the requested page is parsed
+        :param block: DumpBlock
         :param articleid:
         :param id: wikidataid
         :return:
         """
 
-        doc = ET.fromstring( "<doc>" + xml + "</doc>")
-        for page in doc.findall("page"):
-            id = int(page.find("id").text)
-            if( id == articleid):
-                return self.__article_xml_to_text( page, wikidata_id)
+        page_xml = block.page( articleid)
+        if page_xml is None:
+            return "" # not found
 
-        return "" # not found
+        page = ET.fromstring( page_xml)
+        return Wikidata.__article_xml_to_text( page, wikidata_id)
 
 
 
-    def __article_xml_to_text(self, page, wikidata_id):
+    @staticmethod
+    def __article_xml_to_text(page, wikidata_id):
         """
-        Retrieves the text from the page element
+        Retrieves the text from the page element, the result is the same as the pretty printed xml
+        of an article element with an id, title, pageid, revisionid and text element
         :param page:
         :return:
         """
 
-        article = ET.Element("article")
+        revision = page.find("revision")
+        parts = ["<article>\n"]
+        for (name, text) in [("id", wikidata_id), ("title", page.find("title").text), ("pageid", page.find("id").text),
+                             ("revisionid", revision.find("id").text), ("text", revision.find("text").text)]:
+            if text is None:
+                parts.append( f"  <{name}/>\n")
+            else:
+                parts.append( f"  <{name}>{Wikidata.__escape( text)}</{name}>\n")
+        parts.append("</article>\n")
+
+        return "".join( parts)
 
-        ET.SubElement( article, "id").text = wikidata_id
-        ET.SubElement(article, "title").text = page.find("title").text
-        ET.SubElement(article, "text").text = page.find("revision").find("text").text
 
-        return functions.xml_as_string(article)
+    @staticmethod
+    def __escape(text):
+        """
+        Escape text in the same way as lxml does
+        :param text:
+        :return:
+        """
+
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("\r", "&#13;")
 
 
     def get_random_articles(self, exceptions, count, only_starting_with_a = False):
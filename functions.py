@@ -1,6 +1,9 @@
 import hashlib
+import itertools
 import os
 import shutil
+import sys
+from collections import deque
 from pathlib import Path
 from lxml import etree as ET
 
@@ -113,6 +116,70 @@ def create_chunks_of_list(theList, chunk_size):
 
     return [theList[i:i + chunk_size] for i in range(0, len(theList), chunk_size)]
 
+def create_chunks_of_iterable(iterable, chunk_size):
+    """
+    Splits an iterable into lists with chunks, the iterable is only read when the next chunk is needed
+    :param iterable:
+    :param chunk_size:
+    :return: generator of lists
+    """
+
+    iterator = iter( iterable)
+    chunk = list( itertools.islice( iterator, chunk_size))
+    while len(chunk) > 0:
+        yield chunk
+        chunk = list( itertools.islice( iterator, chunk_size))
+
+def bounded_map(executor, max_pending, function, *arguments):
+    """
+    Same as executor.map, but at most max_pending tasks are submitted ahead of the consumer of the results,
+    so the arguments are read and the results are kept only when they are needed
+    :param executor: a concurrent.futures executor
+    :param max_pending: maximum number of submitted tasks of which the result is not yet returned
+    :param function:
+    :param arguments: iterables with the arguments of the function
+    :return: generator of the results in the order of the arguments
+    """
+
+    pending = deque()
+    for task in zip( *arguments):
+        pending.append( executor.submit( function, *task))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+
+    while len(pending) > 0:
+        yield pending.popleft().result()
+
+def peak_memory_mb():
+    """
+    Returns the peak memory (resident set size) of this process in MB, 0 if it is not available
+    :return:
+    """
+
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return 0
+
+    peak = resource.getrusage( resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, kilobytes on Linux
+
+def jaccard_index(intersection_length, union_length):
+    """
+    Calculates the jaccard index from the lengths of the intersection and the union of two sets
+    10 or more common elements always give 0.75
+    :param intersection_length:
+    :param union_length:
+    :return:
+    """
+
+    if union_length == 0 or intersection_length == 0:
+        return 0
+    elif intersection_length >= 10:
+        return 0.75
+    else:
+        return intersection_length / union_length
+
 def write_corpus_info(corpusdir, name, language_code):
     """
     Write the corpus info
@@ -0,0 +1,67 @@
+# Compares Sections.clean_wiki_text with the previous implementation on real articles and measures the speed
+# run as: python test/clean_benchmark.py <directory with the xml files of step 1> [repeats]
+import os
+import re
+import sys
+import time
+import wikitextparser as wtp
+from lxml import etree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import functions
+from Sections import Sections
+
+curly_braces_re = re.compile(r"\{[^}]+}")
+category_re = re.compile(r"^Category:.*?$", flags=re.MULTILINE | re.IGNORECASE)
+file_re = re.compile(r"^File:.*?$", flags=re.MULTILINE | re.IGNORECASE)
+white_spaces_re = re.compile(r"[ \t]+")
+
+
+def clean_wiki_text( text):
+    """
+    The previous implementation of Sections.clean_wiki_text, the golden reference
+    :param text:
+    :return:
+    """
+    clean = curly_braces_re.sub("", text)  # Remove everyting between curly braces
+    clean = category_re.sub("", clean)  # Remove the categories
+    clean = file_re.sub("", clean)  # Remove the categories
+    clean = clean.replace("=====", "")
+    clean = clean.replace("====", "")
+    clean = clean.replace("===", "")
+    clean = clean.replace("==", "")
+
+    # Remove white spaces and list items
+    not_list_item_or_empty_lines = [line for line in clean.split("\n") if
+                                        not line.strip().startswith("#")
+                                        and not line.strip().startswith("*")
+                                        and white_spaces_re.sub("", line) != ""]
+    clean = "\n".join(not_list_item_or_empty_lines)
+
+    # Remove the double spaces
+    clean = white_spaces_re.sub(" ", clean)
+
+    return clean
+
+
+
+directory = sys.argv[1]
+repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+# The plain text of all sections, as it is passed to clean_wiki_text
+texts = []
+for file in functions.read_all_files_from_directory(directory, "xml"):
+    text = ET.fromstring(functions.read_file(file)).find("text").text
+    if not text is None:
+        texts.extend([section.plain_text() for section in wtp.parse(text).sections])
+
+sections = Sections("<page><title/><text/></page>")
+different = sum(1 for text in texts if clean_wiki_text(text) != sections.clean_wiki_text(text))
+print(f"{len(texts)} sections, {sum(len(text) for text in texts)} characters, {different} different")
+
+for (name, function) in [("previous", clean_wiki_text), ("current", sections.clean_wiki_text)]:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for text in texts:
+            function(text)
+    print(f"{name:10}: {(time.perf_counter() - start) / repeats:.3f} s")
@@ -0,0 +1,93 @@
+# Adds three subjects one after another to the same output directory with --incremental and compares the links with
+# a run of all subjects at once, to check that the files of the earlier subjects are patched with the links to the later ones
+# run as: python test/incremental_links.py [articles per subject]
+import os
+import sys
+import tempfile
+from lxml import etree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import functions
+import WikiDataCorpus
+
+
+def create_documents(subject, articles, topics):
+    """
+    Generates articles with two sections that link to topics that are shared by the subjects and to other articles
+    """
+
+    for i in range(articles):
+        doc = ET.Element("doc", attrib={"id": f"{subject}{i}"})
+        ET.SubElement(doc, "title").text = f"{subject} article {i}"
+        for (number, keys) in enumerate([[topics[i % len(topics)], topics[(i + 1) % len(topics)], f"A article {i // 2}"],
+                                         [topics[(i * 3) % len(topics)], f"{subject} article {(i + 1) % articles}"]]):
+            section = ET.SubElement(doc, "section", attrib={"id": f"{subject}{i}_{number + 1:02}"})
+            ET.SubElement(section, "title").text = f"Section {number + 1}"
+            key_elem = ET.SubElement(section, "keys")
+            for key in keys:
+                ET.SubElement(key_elem, "key").text = key
+            ET.SubElement(section, "text").text = f"Text of section {number + 1} of {subject} article {i}"
+
+        yield (doc, f"{subject}{i}.xml")
+
+
+def read_links(output_dir):
+    """
+    Returns for every output file the links of the article and the sections as sets
+    """
+
+    links = {}
+    for file in functions.read_all_files_from_directory(output_dir, "xml"):
+        doc = ET.parse(str(file)).getroot()
+        for elem in [doc] + list(doc.iter("section")):
+            links[elem.attrib["id"]] = {(link.attrib["id"], link.attrib["index"]) for link in elem.find("links").iter("link")}
+
+    return links
+
+
+def read_files(output_dir):
+    return {os.path.basename(file): functions.read_file(str(file)) for file in functions.read_all_files_from_directory(output_dir, "xml")}
+
+
+def run(articles):
+    topics = [f"Topic {i}" for i in range(5)]
+    with tempfile.TemporaryDirectory() as directory:
+        incremental_dir = os.path.join(directory, "incremental")
+        full_dir = os.path.join(directory, "full")
+
+        print("Subject A:")
+        WikiDataCorpus.step3(input_dir=None, output_dir=incremental_dir, treshold=0.2, incremental=True,
+                             documents=create_documents("A", articles, topics))
+        first = read_files(incremental_dir)
+
+        print("Subject B in the same output directory:")
+        WikiDataCorpus.step3(input_dir=None, output_dir=incremental_dir, treshold=0.2, incremental=True,
+                             documents=create_documents("B", articles, topics))
+        second = read_files(incremental_dir)
+        patched = [filename for filename in first.keys() if first[filename] != second[filename]]
+        print(f"{len(patched)} of the {len(first)} files of subject A patched, {len(second) - len(first)} files added")
+
+        print("Subject C with two articles:")
+        WikiDataCorpus.step3(input_dir=None, output_dir=incremental_dir, treshold=0.2, incremental=True,
+                             documents=create_documents("C", 2, topics[:1]))
+        third = read_files(incremental_dir)
+        patched = [filename for filename in second.keys() if second[filename] != third[filename]]
+        print(f"{len(patched)} of the {len(second)} files of subjects A and B patched, {len(third) - len(second)} files added")
+
+        print("Subject C again:")
+        WikiDataCorpus.step3(input_dir=None, output_dir=incremental_dir, treshold=0.2, incremental=True,
+                             documents=create_documents("C", 2, topics[:1]))
+        print(f"Files changed: {sum(1 for (filename, contents) in read_files(incremental_dir).items() if third[filename] != contents)}")
+
+        print("All subjects at once:")
+        WikiDataCorpus.step3(input_dir=None, output_dir=full_dir, treshold=0.2,
+                             documents=(document for (subject, number, subject_topics) in [("A", articles, topics), ("B", articles, topics), ("C", 2, topics[:1])]
+                                        for document in create_documents(subject, number, subject_topics)))
+
+        incremental_links = read_links(incremental_dir)
+        full_links = read_links(full_dir)
+        different = [id for id in full_links.keys() if incremental_links.get(id) != full_links[id]]
+        print(f"Links of {len(full_links)} articles and sections, {len(different)} different from the run at once {different[:10]}")
+
+
+run(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
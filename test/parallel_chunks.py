@@ -0,0 +1,69 @@
+# Counts the sparse matrix products of SparseJaccard in a serial run and in parallel runs of step 3, every chunk must be
+# calculated once and every row must be in one chunk, also when the ranges of files are handled by several workers
+# run as: python test/parallel_chunks.py [number of articles] [rows per chunk]
+import filecmp
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from lxml import etree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import WikiDataCorpus
+from SparseJaccard import SparseJaccard
+
+calls = multiprocessing.Value("q", 0)  # Shared with the forked workers
+rows = multiprocessing.Value("q", 0)
+calculate_chunk = SparseJaccard._SparseJaccard__calculate_chunk
+
+
+def counted_calculate_chunk(self, group, first, last):
+    with calls.get_lock():
+        calls.value += 1
+        rows.value += last - first
+
+    return calculate_chunk(self, group, first, last)
+
+
+SparseJaccard._SparseJaccard__calculate_chunk = counted_calculate_chunk
+
+
+def create_documents(articles):
+    """
+    Generates articles with three sections that link to topics and to other articles
+    """
+
+    for i in range(articles):
+        doc = ET.Element("doc", attrib={"id": f"Q{i}"})
+        ET.SubElement(doc, "title").text = f"Article {i}"
+        for number in range(3):
+            section = ET.SubElement(doc, "section", attrib={"id": f"Q{i}_{number + 1:02}"})
+            ET.SubElement(section, "title").text = f"Section {number + 1}"
+            key_elem = ET.SubElement(section, "keys")
+            for key in [f"Topic {(i * (number + 1)) % 97}", f"Topic {(i + number) % 31}", f"Article {(i * 7 + number) % articles}"]:
+                ET.SubElement(key_elem, "key").text = key
+            ET.SubElement(section, "text").text = f"Text of section {number + 1} of article {i}"
+
+        yield (doc, f"Q{i}.xml")
+
+
+def run(articles):
+    total_rows = articles * 4
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in [1, 4, 8]:
+            calls.value = 0
+            rows.value = 0
+            output_dir = os.path.join(directory, f"workers_{workers}")
+            start = time.time()
+            WikiDataCorpus.step3(input_dir=None, output_dir=output_dir, treshold=0.2, workers=workers, documents=create_documents(articles))
+            print(f"{workers} worker(s): {calls.value} chunks calculated, {rows.value} rows of {total_rows}, {time.time() - start:.1f} s")
+
+            if workers > 1:
+                comparison = filecmp.dircmp(os.path.join(directory, "workers_1"), output_dir)
+                print(f"Same files as 1 worker: {len(comparison.diff_files) == 0 and len(comparison.left_only) == 0 and len(comparison.right_only) == 0}")
+
+
+if len(sys.argv) > 2:
+    SparseJaccard.rows_per_chunk = int(sys.argv[2])
+run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,149 @@
+# Runs WDSparql against a local stand-in for the WikiData query service, to check the connection reuse,
+# the Retry-After handling, the retries, the concurrent queries and the cache without sending queries to WikiData
+# run as: python test/sparql_endpoint.py [number of queries]
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import functions
+from WikiDataSparql import WDSparql
+
+
+class Endpoint(BaseHTTPRequestHandler):
+    """
+    Answers every query with a result with its path after "delay" seconds, except the queries in "busy" (429 with
+    Retry-After) and "failing" (503), which are counted per query, the queries with more than "max_items" items
+    in the VALUES (500 as a query that takes too long, or an incomplete result if "truncate") and all queries
+    if "unavailable" (503)
+    """
+
+    protocol_version = "HTTP/1.1"  # Keep-alive
+    wbufsize = 65536                # Send the headers and the body at once
+    busy = {}
+    failing = {}
+    delay = 0.0
+    max_items = None
+    truncate = False
+    unavailable = False
+    requests = 0
+    connections = set()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with Endpoint.lock:
+            Endpoint.requests += 1
+            Endpoint.connections.add(self.client_address)
+            query = self.path
+            busy = Endpoint.busy.get(query, 0)
+            failing = Endpoint.failing.get(query, 0)
+            if busy > 0:
+                Endpoint.busy[query] = busy - 1
+            elif failing > 0:
+                Endpoint.failing[query] = failing - 1
+
+        items = parse.parse_qs(parse.urlparse(query).query).get("query", [""])[0].split()
+        time.sleep(Endpoint.delay)
+        if Endpoint.unavailable:
+            self.send(503, b"Service unavailable", {})
+        elif not Endpoint.max_items is None and len(items) > Endpoint.max_items:
+            if Endpoint.truncate:
+                self.send(200, b'{"head": {"vars": ["path"]}, "results": {"bindings": [{"pa', {})
+            else:
+                self.send(500, b"Query timeout", {})
+        elif busy > 0:
+            self.send(429, b"Too many requests", {"Retry-After": "1"})
+        elif failing > 0:
+            self.send(503, b"Service unavailable", {})
+        else:
+            self.send(200, json.dumps({"results": {"bindings": [{"path": {"value": query}}]}}).encode("utf-8"), {})
+
+    def send(self, status, body, headers):
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(queries):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Endpoint)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}/sparql"
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # A json file of the previous cache is imported
+        legacy = {"results": {"bindings": [{"path": {"value": "legacy"}}]}, "sparq": "SELECT legacy"}
+        functions.write_file(os.path.join(cache_dir, functions.hash_string("legacy") + ".json"), json.dumps(legacy))
+        wikidata = WDSparql(cache_dir, endpoint)
+        rows = wikidata.query("SELECT legacy", "legacy")
+        print(f"Imported query: {Endpoint.requests} requests, rows {rows}")
+
+        # Plain queries
+        start = time.time()
+        for i in range(queries):
+            wikidata.query(f"SELECT {i}", f"plain_{i}")
+        print(f"{queries} queries: {time.time() - start:.2f} s, {Endpoint.requests} requests, {len(Endpoint.connections)} connection(s)")
+
+        # Cached queries are not sent again
+        Endpoint.requests = 0
+        for i in range(queries):
+            wikidata.query(f"SELECT {i}", f"plain_{i}")
+        print(f"Cached queries: {Endpoint.requests} requests")
+
+        # A busy server and a failing server
+        Endpoint.requests = 0
+        Endpoint.busy["/sparql?format=json&query=SELECT+busy"] = 1
+        Endpoint.failing["/sparql?format=json&query=SELECT+failing"] = 2
+        start = time.time()
+        wikidata.query("SELECT busy", "busy")
+        print(f"Retry-After 1 s: {time.time() - start:.2f} s, {Endpoint.requests} requests")
+        start = time.time()
+        wikidata.query("SELECT failing", "failing")
+        print(f"Two errors: {time.time() - start:.2f} s, {Endpoint.requests} requests")
+
+        # Chunks one after another and at the same time, with 50 ms per query
+        Endpoint.delay = 0.05
+        chunks = [[f"wd:Q{i}" for i in range(start, start + 5)] for start in range(0, 100, 5)]
+        create_query = lambda items: " ".join(items)
+        for (name, max_concurrent) in [("One at a time", 1), ("Concurrent", None)]:
+            Endpoint.requests = 0
+            start = time.time()
+            rows = wikidata.query_chunks(chunks, create_query, name, max_concurrent)
+            print(f"{name}: {time.time() - start:.2f} s, {Endpoint.requests} requests, {len(rows)} rows")
+
+        # Chunks that are too large are split
+        Endpoint.delay = 0.0
+        Endpoint.max_items = 2
+        Endpoint.requests = 0
+        rows = wikidata.query_chunks(chunks[:2], create_query, "split")
+        print(f"Split: {Endpoint.requests} requests, rows {[parse.unquote_plus(row['path']['value'].split('=')[-1]) for row in rows]}")
+        Endpoint.truncate = True
+        Endpoint.requests = 0
+        rows = wikidata.query_chunks(chunks[2:4], create_query, "truncated")
+        print(f"Split incomplete results: {Endpoint.requests} requests, {len(rows)} rows")
+
+        # An endpoint that is not available is not queried with smaller chunks
+        Endpoint.unavailable = True
+        Endpoint.requests = 0
+        try:
+            wikidata.query_chunks(chunks[4:5], create_query, "unavailable")
+        except Exception as error:
+            print(f"Unavailable: {Endpoint.requests} requests, {type(error).__name__}")
+        Endpoint.unavailable = False
+
+        print(WDSparql.cache_statistics())
+
+    server.shutdown()
+
+
+run(int(sys.argv[1]) if len(sys.argv) > 1 else 200)